@@ -0,0 +1,236 @@
+"""
+Microbenchmarks for the polling hot paths
+
+Times packet encoding and decoding, stroke decoding, response handling and,
+when Plover is installed, whole StenographMachine.run() poll cycles against
+an in-memory writer. Given a traffic log, also times decoding the responses
+recorded in it. Importing the packages is timed in fresh interpreters, as
+that is what Plover's plugin scan pays at startup. Results are written as
+JSON so runs on different commits can be compared:
+
+    python benchmarks/hot_paths.py -o before.json
+    python benchmarks/hot_paths.py -o after.json --compare before.json
+"""
+from argparse import ArgumentParser
+from timeit import Timer
+import json
+import os
+import platform
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stenograph.emulator import EmulatedTransport, EmulatedWriter
+from stenograph.packet import PacketType, ReadRequest, StenoPacket
+from stenograph.recording import RESPONSE, read_records
+from stenograph.scheduler import FixedPollScheduler
+from stenograph.stroke import Stroke, STROKE_SIZE
+from stenograph.transport import MachineTransport
+
+
+STROKES_PER_PACKET = 64
+RUN_CYCLES = 1000
+IMPORTED_PACKAGES = ('stenograph', 'plover_stenograph')
+
+
+def make_response(stroke_count=STROKES_PER_PACKET):
+    writer = EmulatedWriter()
+    return StenoPacket(
+        sequence_number=1,
+        packet_type=PacketType.READ_FILE,
+        data=b''.join(writer.make_stroke(i) for i in range(stroke_count)),
+    )
+
+
+def codec_benchmarks():
+    response = make_response()
+    packed = response.pack()
+    unpacked = StenoPacket.unpack(packed)
+    stroke_data = packed[StenoPacket.HEADER_SIZE:StenoPacket.HEADER_SIZE + STROKE_SIZE]
+    request = ReadRequest()
+    request.sequence_number = 1
+    transport = MachineTransport()
+    return {
+        'packet_pack': response.pack,
+        'packet_unpack': lambda: StenoPacket.unpack(packed),
+        'packet_strokes': unpacked.strokes,
+        'stroke_unpack': lambda: Stroke.unpack(stroke_data),
+        'read_request_prepare': lambda: request.prepare(0x1000).pack(),
+        'handle_response': lambda: transport.handle_response(unpacked),
+    }
+
+
+class _Keymap:
+    """Passes keys straight through, standing in for Plover's keymap"""
+
+    @staticmethod
+    def keys_to_actions(keys):
+        return list(keys)
+
+
+class _CountingTransport(EmulatedTransport):
+    """Writes a stroke every other request, and stops the machine after a number of them"""
+
+    def __init__(self, writer, cycles):
+        super().__init__(writer)
+        self.machine = None
+        self.cycles = cycles
+
+    def send(self, request):
+        self.cycles -= 1
+        if self.cycles <= 0:
+            self.machine.finished.set()
+        if self.cycles % 2:
+            self.writer.write_strokes(1)
+        super().send(request)
+
+
+def run_cycle_benchmark(cycles=RUN_CYCLES):
+    """Per-cycle time of StenographMachine.run(), or None without Plover"""
+    try:
+        from plover_stenograph.base import StenographMachine
+    except ImportError:
+        return None
+
+    def run():
+        transport = _CountingTransport(EmulatedWriter(), cycles)
+        machine = StenographMachine(transport, {}, scheduler=FixedPollScheduler(0))
+        machine.keymap = _Keymap()
+        transport.machine = machine
+        transport.connect()
+        machine.run()
+
+    return run, cycles
+
+
+def traffic_log_benchmark(path):
+    """Decoding every response in a traffic log, and how many there are"""
+    with open(path, 'rb') as f:
+        log = f.read()
+    responses = [bytes(packet) for kind, _timestamp, packet in read_records(log) if kind == RESPONSE]
+
+    def decode():
+        for packet in responses:
+            response = StenoPacket.unpack(packet)
+            if response.packet_type == PacketType.READ_FILE and response.data_length:
+                response.strokes()
+
+    return decode, max(len(responses), 1)
+
+
+def import_benchmark(package):
+    """Function importing package in a new interpreter and returning how long the
+    import took, or None if it can't be imported"""
+    code = (
+        'import sys, time; sys.path.insert(0, %r); start = time.perf_counter(); '
+        'import %s; print(time.perf_counter() - start)' % (ROOT, package)
+    )
+
+    def run():
+        return float(subprocess.check_output([sys.executable, '-c', code], stderr=subprocess.DEVNULL))
+
+    try:
+        run()
+    except subprocess.CalledProcessError:
+        return None
+    return run
+
+
+def measure_import(function, repeat):
+    times = [function() for _ in range(repeat)]
+    return {
+        'best': min(times),
+        'mean': sum(times) / len(times),
+        'loops': 1,
+        'repeat': repeat,
+    }
+
+
+def measure(function, repeat, per_call=1):
+    """Time function, which does per_call operations, returning seconds per operation"""
+    timer = Timer(function)
+    # Slow enough to time one call at a time when it runs a whole loop.
+    loops = timer.autorange()[0] if per_call == 1 else 1
+    times = [elapsed / loops / per_call for elapsed in timer.repeat(repeat, loops)]
+    return {
+        'best': min(times),
+        'mean': sum(times) / len(times),
+        'loops': loops * per_call,
+        'repeat': repeat,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Time the stenograph hot paths')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per benchmark')
+    parser.add_argument('-k', dest='only', help='only run benchmarks whose name contains this')
+    parser.add_argument('--traffic-log', help='also time decoding the responses in this traffic log')
+    args = parser.parse_args(argv)
+
+    benchmarks = [(name, function, 1) for name, function in codec_benchmarks().items()]
+    imports = []
+    for package in IMPORTED_PACKAGES:
+        function = import_benchmark(package)
+        if function is None:
+            print('Cannot import %s, skipping import_%s' % (package, package), file=sys.stderr)
+        else:
+            imports.append(('import_' + package, function))
+    run_cycle = run_cycle_benchmark()
+    if run_cycle is None:
+        print('Plover is not installed, skipping machine_run_cycle', file=sys.stderr)
+    else:
+        function, cycles = run_cycle
+        benchmarks.append(('machine_run_cycle', function, cycles))
+    if args.traffic_log:
+        function, responses = traffic_log_benchmark(args.traffic_log)
+        benchmarks.append(('traffic_log_decode', function, responses))
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = {}
+
+    def print_result(name, result):
+        results[name] = result
+        line = '%-24s %10.3f us' % (name, result['best'] * 1e6)
+        if name in previous:
+            line += '  %5.2fx' % (result['best'] / previous[name]['best'])
+        print(line)
+
+    for name, function, per_call in benchmarks:
+        if not args.only or args.only in name:
+            print_result(name, measure(function, args.repeat, per_call=per_call))
+    for name, function in imports:
+        if not args.only or args.only in name:
+            print_result(name, measure_import(function, args.repeat))
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,26 @@
 from plover import log
 from plover.machine.base import ThreadedStenotypeBase
 
-from stenograph import *
-from time import sleep
+from stenograph.exception import (
+    ConnectionError, NoRealtimeFileException, FinishedReadingClosedFileException,
+    ProtocolViolationException,
+)
+from stenograph.latency import LatencyHistogram, WriterClock
+from stenograph.reader import RealtimeReader
+from stenograph.recording import TrafficRecorder
+from stenograph.scheduler import AdaptivePollScheduler
+from stenograph.stroke import Stroke
+from stenograph.stroke_queue import StrokeQueue
+from functools import lru_cache
+from threading import Lock, Thread
+from time import monotonic
+
+
+# Distinct strokes to remember the translation of, most writers repeat far fewer.
+TRANSLATION_CACHE_SIZE = 512
+
+# Seconds between warnings about strokes dropped because Plover is behind.
+DROP_WARNING_INTERVAL = 10
 
 
 class StenographMachine(ThreadedStenotypeBase):
@@ -16,13 +34,135 @@ class StenographMachine(ThreadedStenotypeBase):
     """
     KEYMAP_MACHINE_TYPE = "Stentura"
 
-    def __init__(self, transport, params):
+    def __init__(self, transport, params, scheduler=None):
         super().__init__()
         self._transport = transport
+        if scheduler is None:
+            try:
+                scheduler = AdaptivePollScheduler(
+                    min_interval=params.get('min_poll_interval', AdaptivePollScheduler.MIN_INTERVAL),
+                    max_interval=params.get('max_poll_interval', AdaptivePollScheduler.MAX_INTERVAL),
+                )
+            except ValueError as e:
+                log.warning("Ignoring Stenograph poll interval options: %s", e)
+                scheduler = AdaptivePollScheduler()
+        self._scheduler = scheduler
+        self._writer_clock = WriterClock()
+        # Time from keypress on the writer to handing the stroke to Plover.
+        self.latency = LatencyHistogram()
+        # The dispatcher records latencies while stats() may read them.
+        self._latency_lock = Lock()
+        # Strokes go to Plover from their own thread, so translating them
+        # never holds up the next poll.
+        self._stroke_queue = StrokeQueue(params.get('stroke_queue_size') or StrokeQueue.SIZE)
+        # Strokes dropped since the last warning about it, and when to warn again.
+        self._dropped_unlogged = 0
+        self._next_drop_warning = 0
+        # Stroke mask -> steno keys, for the keymap and machine type they were translated with.
+        self._translation_cache_size = params.get('translation_cache_size', TRANSLATION_CACHE_SIZE)
+        self._translation_keymap = None
+        self._translation_machine_type = None
+        self._translate = None
+        # Kept here as well, the transport is dropped on stop_capture.
+        self._stats = transport.stats
+        self._rtt_estimator = transport.rtt_estimator
+        if params.get('min_timeout') or params.get('max_timeout'):
+            # A bound left at 0 moves out of the way of the one that was set.
+            min_timeout = params.get('min_timeout') or min(transport.MIN_TIMEOUT, params['max_timeout'])
+            max_timeout = params.get('max_timeout') or max(transport.MAX_TIMEOUT, min_timeout)
+            try:
+                transport.set_timeout_bounds(min_timeout, max_timeout)
+            except ValueError as e:
+                log.warning("Ignoring Stenograph timeout options: %s", e)
+        self._stats_log_interval = params.get('stats_log_interval', 0)
+        self._recorder = None
+        if params.get('traffic_log'):
+            self._recorder = TrafficRecorder(params['traffic_log'])
+            transport.recorder = self._recorder
+
+    @classmethod
+    def get_option_info(cls):
+        return {
+            'min_poll_interval': (AdaptivePollScheduler.MIN_INTERVAL, float),
+            'max_poll_interval': (AdaptivePollScheduler.MAX_INTERVAL, float),
+            # Largest read while catching up, 0 for the transport's default.
+            'max_read': (0, int),
+            # Bounds in seconds of the response timeout, 0 for the transport's default.
+            'min_timeout': (0, float),
+            'max_timeout': (0, float),
+            # Seconds between stats summaries in the log, 0 to turn them off.
+            'stats_log_interval': (0, float),
+            # File to append all traffic with the writer to, for replaying later.
+            'traffic_log': ('', str),
+            # Strokes waiting for Plover before the oldest are dropped.
+            'stroke_queue_size': (StrokeQueue.SIZE, int),
+            # Distinct strokes to cache the keymap translation of, 0 to not cache.
+            'translation_cache_size': (TRANSLATION_CACHE_SIZE, int),
+        }
+
+    def stats(self):
+        """Counters and timings for the connection to the writer, as a dict"""
+        stats = self._stats.snapshot(monotonic())
+        with self._latency_lock:
+            stats['latency'] = self.latency.summary()
+        stats['timeout'] = self._rtt_estimator.summary()
+        stats['stroke_queue'] = self._stroke_queue.summary()
+        if self._translate is not None:
+            hits, misses, max_size, size = self._translate.cache_info()
+            stats['translation_cache'] = {
+                'hits': hits, 'misses': misses, 'size': size, 'max_size': max_size,
+            }
+        return stats
 
-    def _on_stroke(self, keys):
-        steno_keys = self.keymap.keys_to_actions(keys)
+    def set_keymap(self, keymap):
+        super().set_keymap(keymap)
+        # The keymap may have been changed in place, so always start over.
+        self._reset_translations()
+
+    def _reset_translations(self):
+        keymap = self.keymap
+
+        def translate(mask):
+            return tuple(keymap.keys_to_actions(Stroke(mask).keys))
+
+        self._translation_keymap = keymap
+        self._translation_machine_type = self.KEYMAP_MACHINE_TYPE
+        self._translate = lru_cache(maxsize=self._translation_cache_size)(translate)
+
+    def _queue_stroke(self, stroke):
+        # The writer clock belongs to the polling thread, so convert the time here.
+        written_at = self._writer_clock.host_time(stroke.timestamp)
+        if not self._stroke_queue.put((stroke, written_at)):
+            self._dropped_unlogged += 1
+            if monotonic() >= self._next_drop_warning:
+                self._log_dropped()
+
+    def _log_dropped(self):
+        log.warning("Plover is falling behind, dropped %u stroke(s) from the Stenograph writer",
+                    self._dropped_unlogged)
+        self._dropped_unlogged = 0
+        self._next_drop_warning = monotonic() + DROP_WARNING_INTERVAL
+
+    def _dispatch_strokes(self):
+        """Hand queued strokes to Plover until the queue is closed"""
+        while True:
+            item = self._stroke_queue.get()
+            if item is None:
+                return
+            try:
+                self._on_stroke(*item)
+            except Exception:
+                log.error("Error handling Stenograph stroke", exc_info=True)
+
+    def _on_stroke(self, stroke, written_at):
+        if (self.keymap is not self._translation_keymap or
+                self.KEYMAP_MACHINE_TYPE != self._translation_machine_type):
+            self._reset_translations()
+        steno_keys = self._translate(stroke.mask)
         if steno_keys:
+            if written_at is not None:
+                with self._latency_lock:
+                    self.latency.record(monotonic() - written_at)
             self._notify(steno_keys)
 
     def start_capture(self):
@@ -45,7 +185,10 @@ class StenographMachine(ThreadedStenotypeBase):
 
     def _reconnect(self):
         self._error()
-        while not self.finished.wait(0.25):
+        while not self.finished.is_set():
+            self._transport.wait_for_device(self.finished, 0.25)
+            if self.finished.is_set():
+                break
             try:
                 self._initializing()
                 self._transport.connect()
@@ -57,70 +200,109 @@ class StenographMachine(ThreadedStenotypeBase):
 
     def _send_receive(self, request):
         """Send a StenoPacket and return the response or raise exceptions."""
-        log.debug("Requesting from Stenograph writer: %s", request)
-        response = self._transport.send_receive(request)
+        try:
+            response = self._transport.send_receive(request)
+        finally:
+            # Only the transport numbers requests, so log it once sent.
+            log.debug("Requested from Stenograph writer: %s", request)
         log.debug("Response from Stenograph writer: %s", response)
         return response
 
-    def run(self):
+    def _read_pipelined(self, offset):
+        """Read ahead from offset, logging like _send_receive()"""
+        transport = self._transport
+        log.debug("Reading ahead from Stenograph writer at offset %u, %u requests in flight",
+                  offset, transport.pipeline_depth)
+        for response in transport.read_pipelined(offset):
+            log.debug("Response from Stenograph writer: %s", response)
+            yield response
 
-        class ReadState:
-            def __init__(self):
-                self.realtime = False  # Not realtime until we get a 0-length response
-                self.realtime_file_open = False  # We are reading from a file
-                self.offset = 0  # File offset to read from
-
-            def reset(self):
-                self.__init__()
-
-        state = ReadState()
+    def run(self):
+        reader = RealtimeReader(scheduler=self._scheduler)
 
         # Tracks whether the machine *just* disconnected, or has been disconnected
         # for a while, to prevent showing the warning more times than needed.
         disconnected = False
+        # Whether _ready() was called since _reconnect() last changed the state.
+        ready = False
 
-        while not self.finished.isSet():
-            try:
-                if not state.realtime_file_open:
-                    # Open realtime file
-                    self._send_receive(StenoPacket.make_open_request())
-                    state.realtime_file_open = True
-                response = self._send_receive(
-                    StenoPacket.make_read_request(file_offset=state.offset)
-                )
-            except ConnectionError as e:
-                if not disconnected:
-                    log.warning("Stenograph writer disconnected, attempting to reconnect")
-                    disconnected = True
-                log.debug("Stenograph writer exception: %s", e)
-                # User could start a new file while disconnected.
-                state.reset()
-                self._reconnect()
-            except NoRealtimeFileException:
-                # User hasn"t started writing, just keep opening the realtime file
-                state.reset()
-            except FinishedReadingClosedFileException:
-                # File closed! Open the realtime file.
-                state.reset()
-            else:
-                if disconnected:
-                    log.warning("Stenograph writer reconnected")
-                    self._ready()
-                    disconnected = False
-                if response.data_length:
-                    state.offset += response.data_length
-                elif not state.realtime:
-                    self._ready()
-                    state.realtime = True
-                if response.data_length and state.realtime:
-                    for stroke in response.strokes():
-                        self._on_stroke(stroke.keys)
-                if state.realtime:
-                    sleep(0.10)
-
-        self._transport.disconnect()
+        stats = self._stats
+        next_stats_log = monotonic() + self._stats_log_interval
+
+        self._stroke_queue.open()
+        dispatcher = Thread(target=self._dispatch_strokes, name='StenographDispatcher', daemon=True)
+        dispatcher.start()
+
+        try:
+            while not self.finished.isSet():
+                try:
+                    catching_up = reader.catching_up
+                    if catching_up:
+                        # Nothing is delivered until we catch up, so read ahead.
+                        responses = self._read_pipelined(reader.offset)
+                    else:
+                        responses = (self._send_receive(reader.next_request()),)
+                    for response in responses:
+                        received_at = monotonic()
+                        if disconnected:
+                            stats.record_reconnect(received_at)
+                            log.warning("Stenograph writer reconnected")
+                            self._ready()
+                            ready = True
+                            disconnected = False
+                        was_realtime = reader.realtime
+                        strokes = reader.handle_response(response)
+                        if reader.realtime and not was_realtime and not ready:
+                            self._ready()
+                            ready = True
+                        stats.strokes_read += len(strokes)
+                        if not catching_up:
+                            # Strokes caught up on were held up, calibrating from them would hide that.
+                            for stroke in strokes:
+                                self._writer_clock.observe(stroke.timestamp, received_at)
+                        for stroke in strokes:
+                            self._queue_stroke(stroke)
+                except (ConnectionError, ProtocolViolationException) as e:
+                    # A response to some other request, like one answered after it
+                    # timed out, means we're out of step: start over on a new connection.
+                    stats.record_exception(e)
+                    stats.record_disconnect(monotonic())
+                    if not disconnected:
+                        log.warning("Stenograph writer disconnected, attempting to reconnect")
+                        disconnected = True
+                    log.debug("Stenograph writer exception: %s", e)
+                    reader.disconnected()
+                    # The writer may have restarted, and its clock with it.
+                    self._writer_clock.reset()
+                    self._reconnect()
+                    ready = False
+                except NoRealtimeFileException as e:
+                    # User hasn't started writing, just keep opening the realtime file
+                    stats.record_exception(e)
+                    reader.reset()
+                except FinishedReadingClosedFileException as e:
+                    # File closed! Open the realtime file.
+                    stats.record_exception(e)
+                    reader.reset()
+                else:
+                    if reader.delay:
+                        self.finished.wait(reader.delay)
+                if self._stats_log_interval and monotonic() >= next_stats_log:
+                    log.info("Stenograph writer stats: %s", self.stats())
+                    next_stats_log = monotonic() + self._stats_log_interval
+
+        finally:
+            self._transport.disconnect()
+            # Deliver whatever was already read, even if polling died.
+            self._stroke_queue.close()
+            dispatcher.join()
+            if self._dropped_unlogged:
+                self._log_dropped()
 
     def stop_capture(self):
         super().stop_capture()
         self._transport = None
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
         self._stopped()
@@ -1,8 +1,36 @@
-from stenograph import UsbTransport
+import sys
+
 from plover_stenograph.base import StenographMachine
 
 
 class StenographUsb(StenographMachine):
 
     def __init__(self, params):
-        super().__init__(UsbTransport(), params)
+        # Only pay for pyusb once a USB machine is actually used.
+        from stenograph import UsbTransport
+        if sys.platform.startswith('win32'):
+            transport = UsbTransport(
+                max_read=params.get('max_read'),
+                device_index=params.get('usb_device_index', 0),
+            )
+        else:
+            transport = UsbTransport(
+                max_read=params.get('max_read'),
+                # 0 or empty for any writer.
+                bus=params.get('usb_bus') or None,
+                address=params.get('usb_address') or None,
+                serial_number=params.get('usb_serial_number') or None,
+            )
+        super().__init__(transport, params)
+
+    @classmethod
+    def get_option_info(cls):
+        option_info = super().get_option_info()
+        option_info.update({
+            # Which writer to use when several are plugged in.
+            'usb_bus': (0, int),
+            'usb_address': (0, int),
+            'usb_serial_number': ('', str),
+            'usb_device_index': (0, int),  # Windows only
+        })
+        return option_info
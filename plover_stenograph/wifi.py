@@ -1,8 +1,42 @@
-from stenograph import WiFiTransport
+import os
+
+from plover.misc import boolean
+from plover.oslayer.config import CONFIG_DIR
+
 from plover_stenograph.base import StenographMachine
 
 
+# Remembers the last writer address so reconnects can skip discovery.
+ADDRESS_CACHE = os.path.join(CONFIG_DIR, 'stenograph_wifi_address.txt')
+
+
 class StenographWiFi(StenographMachine):
 
     def __init__(self, params):
-        super().__init__(WiFiTransport(), params)
+        from stenograph import WiFiTransport
+        from stenograph.discovery import BROADCAST_PORT
+        from stenograph.transport_wifi import WRITER_PORT
+        super().__init__(WiFiTransport(
+            address_cache=ADDRESS_CACHE if params.get('wifi_address_cache', True) else None,
+            max_read=params.get('max_read'),
+            address=params.get('wifi_address') or None,
+            port=params.get('wifi_port') or WRITER_PORT,
+            discovery_port=params.get('wifi_discovery_port') or BROADCAST_PORT,
+            subnets=(params.get('wifi_subnets') or '').split(),
+        ), params)
+
+    @classmethod
+    def get_option_info(cls):
+        option_info = super().get_option_info()
+        # Writer host to connect to, empty to discover one.
+        option_info['wifi_address'] = ('', str)
+        # TCP port of the writer, and UDP port it answers discovery on,
+        # 0 for the ports real writers use. Mostly for the emulator.
+        option_info['wifi_port'] = (0, int)
+        option_info['wifi_discovery_port'] = (0, int)
+        # Subnets to probe host by host when broadcasts don't reach the writer,
+        # separated by spaces, like '192.168.1.0/24 10.0.0.0/28'.
+        option_info['wifi_subnets'] = ('', str)
+        # Remember the last writer found in the config directory.
+        option_info['wifi_address_cache'] = (True, boolean)
+        return option_info
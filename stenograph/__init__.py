@@ -1,11 +1,47 @@
 from .stroke import STENO_KEY_CHART
 from .packet import StenoPacket, MAX_READ
 from .exception import *
+from .scheduler import PollScheduler, FixedPollScheduler, AdaptivePollScheduler
+from .reader import RealtimeReader
+from .seek import EndOfFileSeeker
+from .latency import WriterClock, LatencyHistogram, RttEstimator
+from .stats import TransportStats
+from .stroke_queue import StrokeQueue
+from .download import read_file, read_strokes, download_file
+from .recording import TrafficRecorder, ReplayTransport
 
+from importlib import import_module
 import sys
-if sys.platform.startswith('win32'):
-  from .transport_windows import WindowsUsbTransport as UsbTransport
-else:
-  from .transport_libusb import LibusbTransport as UsbTransport
 
-from .transport_wifi import WiFiTransport
+# Transports are only imported once used, so loading the package doesn't
+# load pyusb or the Windows USB APIs for a machine that is never used.
+_LAZY_IMPORTS = {
+  'UsbTransport': ('.transport_windows', 'WindowsUsbTransport')
+    if sys.platform.startswith('win32') else ('.transport_libusb', 'LibusbTransport'),
+  'WiFiTransport': ('.transport_wifi', 'WiFiTransport'),
+}
+
+__all__ = [
+  'STENO_KEY_CHART', 'StenoPacket', 'MAX_READ',
+  'ConnectionError', 'ProtocolViolationException', 'UnableToPerformRequestException',
+  'FileNotAvailableException', 'NoRealtimeFileException', 'FinishedReadingClosedFileException',
+  'PollScheduler', 'FixedPollScheduler', 'AdaptivePollScheduler',
+  'RealtimeReader', 'EndOfFileSeeker',
+  'WriterClock', 'LatencyHistogram', 'RttEstimator', 'TransportStats', 'StrokeQueue',
+  'read_file', 'read_strokes', 'download_file',
+  'TrafficRecorder', 'ReplayTransport',
+] + list(_LAZY_IMPORTS)
+
+
+def __getattr__(name):
+  try:
+    module_name, attribute = _LAZY_IMPORTS[name]
+  except KeyError:
+    raise AttributeError('module %r has no attribute %r' % (__name__, name)) from None
+  value = getattr(import_module(module_name, __name__), attribute)
+  globals()[name] = value
+  return value
+
+
+def __dir__():
+  return sorted(set(globals()) | set(_LAZY_IMPORTS))
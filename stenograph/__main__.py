@@ -0,0 +1,126 @@
+"""Command line tools for Stenograph writers, run with python -m stenograph"""
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+import os
+import sys
+
+from stenograph.discovery import BROADCAST_ADDRESS, BROADCAST_PORT
+from stenograph.transport_wifi import WRITER_PORT
+
+
+def make_transport(args):
+    if args.wifi:
+        from stenograph.transport_wifi import WiFiTransport
+        return WiFiTransport(address=args.address, port=args.port, max_read=args.max_read)
+    from stenograph import UsbTransport
+    return UsbTransport(max_read=args.max_read)
+
+
+def download(args):
+    from stenograph.download import download_file
+
+    output = args.output or args.file_name
+    transport = make_transport(args)
+    transport.connect()
+    try:
+        start = perf_counter()
+        copied = download_file(transport, args.file_name, output, resume=args.resume)
+        elapsed = perf_counter() - start
+    finally:
+        transport.disconnect()
+    print('%s: %u bytes in %.2fs (%.1f KiB/s)'
+          % (output, copied, elapsed, copied / 1024 / elapsed if elapsed else 0),
+          file=sys.stderr)
+
+
+def discover(args):
+    from stenograph.discovery import discover_writers
+
+    writers = discover_writers(args.discovery_address, args.discovery_port,
+                               subnets=args.subnet, window=args.window)
+    for writer in writers:
+        print('%-15s %7.1f ms' % (writer.host, writer.response_time * 1000))
+    if not writers:
+        print('No writers found', file=sys.stderr)
+        sys.exit(1)
+
+
+def emulate(args):
+    from stenograph.emulator import EmulatedWriter, WiFiEmulator
+
+    files = {}
+    for path in args.file:
+        with open(path, 'rb') as f:
+            files[os.path.basename(path).encode('ascii')] = f.read()
+    writer = EmulatedWriter(
+        realtime_strokes=args.realtime_strokes,
+        stroke_rate=args.stroke_rate,
+        files=files,
+    )
+    emulator = WiFiEmulator(
+        writer,
+        host=args.host,
+        port=args.port,
+        discovery_port=args.discovery_port,
+        latency=args.latency,
+        split_size=args.split_size,
+        disconnect_every=args.disconnect_every,
+    )
+    with emulator:
+        print('Emulating a writer on %s, port %u, discovery on port %u'
+              % (emulator.host, emulator.port, emulator.discovery_port), file=sys.stderr)
+        print('In Plover, set the Stenograph Wi-Fi options wifi_address to %s and wifi_port to %u'
+              % (emulator.host, emulator.port), file=sys.stderr)
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m stenograph')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_download = commands.add_parser('download', help='copy a job file off the writer')
+    parser_download.add_argument('file_name', help='name of the file on the writer')
+    parser_download.add_argument('output', nargs='?', help='local path, defaults to file_name')
+    parser_download.add_argument('--wifi', action='store_true', help='connect over Wi-Fi instead of USB')
+    parser_download.add_argument('--address', help='Wi-Fi writer host, discovered if not given')
+    parser_download.add_argument('--port', type=int, default=WRITER_PORT, help='Wi-Fi writer port')
+    parser_download.add_argument('--max-read', type=int, help='largest read to ask the writer for')
+    parser_download.add_argument('--resume', action='store_true',
+                                 help='carry on from the end of an existing output file')
+    parser_download.set_defaults(run=download)
+
+    parser_discover = commands.add_parser('discover', help='list the Wi-Fi writers on the network')
+    parser_discover.add_argument('--subnet', action='append', default=[],
+                                 help='also probe every host of this subnet, like 192.168.1.0/24')
+    parser_discover.add_argument('--window', type=float, default=1, help='seconds to wait for answers')
+    parser_discover.add_argument('--discovery-address', default=BROADCAST_ADDRESS,
+                                 help='where to send the handshake, every interface by default')
+    parser_discover.add_argument('--discovery-port', type=int, default=BROADCAST_PORT,
+                                 help='UDP port writers answer discovery on')
+    parser_discover.set_defaults(run=discover)
+
+    parser_emulate = commands.add_parser('emulate', help='pretend to be a Wi-Fi writer')
+    parser_emulate.add_argument('file', nargs='*', help='closed files for the writer to serve')
+    parser_emulate.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser_emulate.add_argument('--port', type=int, default=0, help='TCP port, any free one by default')
+    parser_emulate.add_argument('--discovery-port', type=int, default=BROADCAST_PORT,
+                                help='UDP port to answer discovery on')
+    parser_emulate.add_argument('--realtime-strokes', type=int, default=0,
+                                help='strokes already in the realtime file')
+    parser_emulate.add_argument('--stroke-rate', type=float, default=2, help='strokes written per second')
+    parser_emulate.add_argument('--latency', type=float, default=0, help='seconds to wait before responding')
+    parser_emulate.add_argument('--split-size', type=int, help='send responses in pieces of this size')
+    parser_emulate.add_argument('--disconnect-every', type=int,
+                                help='drop the connection after this many responses')
+    parser_emulate.set_defaults(run=emulate)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Finding Stenograph writers on the network
+
+Writers answer a UDP handshake sent to their discovery port. The handshake
+goes out every IPv4 interface at once, as a directed broadcast where the
+interface's broadcast address is known, and optionally to every host of
+configured subnets for networks that drop broadcasts. Every writer that
+answers within a short window is returned with its response time.
+
+DiscoveryRound and discovery_targets() are shared with the asyncio
+version in transport_async.
+"""
+from collections import namedtuple
+from time import monotonic
+import ipaddress
+import selectors
+import socket
+import struct
+import sys
+
+from stenograph.exception import ConnectionError
+
+
+# For UDP broadcast. Stenograph machines listen on port 5012 for opening packet.
+# Response is sent on port 5015.
+BROADCAST_ADDRESS = "255.255.255.255"
+BROADCAST_PORT = 5012
+
+# This is the specific reply by Stenograph machines to indicate their presence.
+BATTLE_CRY = b"Calling All Miras...\x00\x00\x00\x00\x00\x00\x00\x00"
+MACHINE_RESPONSE = b"Mira in the neighborhood "
+
+# How long to wait for answers after each handshake.
+DISCOVERY_WINDOW = 0.5
+# How long to keep repeating the handshake before giving up on finding a writer.
+DISCOVERY_TIMEOUT = 10
+
+# Subnets bigger than this are almost certainly a typo, not a writer network.
+MAX_SUBNET_HOSTS = 1024
+
+
+DiscoveredWriter = namedtuple('DiscoveredWriter', ['host', 'response_time'])
+
+
+class DiscoveryRound:
+    """Collects the writers answering one round of handshakes"""
+
+    def __init__(self, sent_at=None):
+        self.sent_at = sent_at
+        self._writers = {}
+
+    def datagram_received(self, data, address, received_at):
+        """Return the DiscoveredWriter if this is a writer's first answer, otherwise None"""
+        host = address[0]
+        if MACHINE_RESPONSE not in data or host in self._writers:
+            return None
+        writer = DiscoveredWriter(host, received_at - self.sent_at)
+        self._writers[host] = writer
+        return writer
+
+    @property
+    def writers(self):
+        """Writers found so far, fastest first"""
+        return sorted(self._writers.values(), key=lambda writer: writer.response_time)
+
+
+def _linux_interface_broadcasts():
+    import fcntl
+
+    SIOCGIFFLAGS = 0x8913
+    SIOCGIFADDR = 0x8915
+    SIOCGIFBRDADDR = 0x8919
+    IFF_UP = 0x1
+    IFF_BROADCAST = 0x2
+    IFF_LOOPBACK = 0x8
+
+    broadcasts = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _index, name in socket.if_nameindex():
+            request = struct.pack('40s', name.encode()[:15])
+            try:
+                flags, = struct.unpack_from('H', fcntl.ioctl(sock, SIOCGIFFLAGS, request), 16)
+                if not flags & IFF_UP or not flags & IFF_BROADCAST or flags & IFF_LOOPBACK:
+                    continue
+                address = socket.inet_ntoa(fcntl.ioctl(sock, SIOCGIFADDR, request)[20:24])
+                broadcast = socket.inet_ntoa(fcntl.ioctl(sock, SIOCGIFBRDADDR, request)[20:24])
+            except OSError:
+                # No IPv4 address on this interface.
+                continue
+            broadcasts.append((address, broadcast))
+    return broadcasts
+
+
+def interface_broadcasts():
+    """Return (local address, broadcast address) for each usable IPv4 interface
+
+    Only Linux reports the broadcast address, elsewhere each local address
+    gets the limited broadcast, which goes out the interface the sending
+    socket is bound to.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return _linux_interface_broadcasts()
+        except OSError:
+            pass
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)}
+    except OSError:
+        return []
+    return [(address, BROADCAST_ADDRESS) for address in sorted(addresses)
+            if not address.startswith('127.')]
+
+
+def subnet_hosts(subnet):
+    """Return the host addresses of a subnet like '192.168.1.0/24'"""
+    network = ipaddress.IPv4Network(subnet, strict=False)
+    if network.num_addresses > MAX_SUBNET_HOSTS:
+        raise ValueError('subnet %s has more than %u hosts' % (subnet, MAX_SUBNET_HOSTS))
+    # /31 and /32 have no network or broadcast address to leave out.
+    hosts = network if network.num_addresses <= 2 else network.hosts()
+    return [str(host) for host in hosts]
+
+
+def discovery_targets(discovery_address=BROADCAST_ADDRESS, subnets=()):
+    """Return {local address to send from: [addresses to send the handshake to]}
+
+    The empty local address lets the OS pick the interface, which is how
+    discovery_address itself is always tried. Only the limited broadcast
+    is spread across the interfaces.
+    """
+    targets = {}
+    if discovery_address == BROADCAST_ADDRESS:
+        for address, broadcast in interface_broadcasts():
+            targets.setdefault(address, []).append(broadcast)
+    destinations = targets.setdefault('', [])
+    destinations.append(discovery_address)
+    for subnet in subnets:
+        destinations.extend(subnet_hosts(subnet))
+    return targets
+
+
+def discover_writers(discovery_address=BROADCAST_ADDRESS, discovery_port=BROADCAST_PORT,
+                     subnets=(), window=DISCOVERY_WINDOW):
+    """Send one round of handshakes and return the writers that answer within window
+
+    Returns a list of DiscoveredWriter, fastest first.
+    """
+    targets = discovery_targets(discovery_address, subnets)
+    selector = selectors.DefaultSelector()
+    sockets = []
+    try:
+        for address, destinations in targets.items():
+            try:
+                udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            except OSError:
+                continue
+            sockets.append(udp)
+            try:
+                udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                udp.bind((address, 0))
+            except OSError:
+                # The interface went away since we listed it.
+                continue
+            udp.setblocking(False)
+            selector.register(udp, selectors.EVENT_READ, destinations)
+        if not selector.get_map():
+            raise ConnectionError("No network interface to discover writers on")
+
+        discovery = DiscoveryRound(monotonic())
+        for key in selector.get_map().values():
+            for destination in key.data:
+                try:
+                    key.fileobj.sendto(BATTLE_CRY, (destination, discovery_port))
+                except OSError:
+                    # Unreachable network, the other destinations may still work.
+                    pass
+
+        deadline = discovery.sent_at + window
+        remaining = window
+        while remaining > 0:
+            for key, _events in selector.select(remaining):
+                try:
+                    data, address = key.fileobj.recvfrom(1024)
+                except OSError:
+                    continue
+                discovery.datagram_received(data, address, monotonic())
+            remaining = deadline - monotonic()
+        return discovery.writers
+    finally:
+        selector.close()
+        for udp in sockets:
+            udp.close()
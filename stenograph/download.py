@@ -0,0 +1,57 @@
+import os
+
+from stenograph.packet import StenoPacket
+from stenograph.stroke import Stroke, STROKE_SIZE
+from stenograph.exception import FinishedReadingClosedFileException
+
+
+def read_file(transport, file_name, offset=0, disk_id=b'A'):
+    """Yield the contents of a file on the writer, from offset to its end
+
+    transport must already be connected. Reads are as large as the
+    transport's max_read and pipelined to its pipeline_depth. Each chunk is
+    a view over the transport's receive buffer, only valid until the
+    generator is resumed.
+    """
+    if isinstance(file_name, str):
+        file_name = file_name.encode('ascii')
+    transport.send_receive(StenoPacket.make_open_request(file_name=file_name, disk_id=disk_id))
+    while True:
+        start = offset
+        try:
+            for response in transport.read_pipelined(offset, transport.max_read):
+                if response.data_length:
+                    offset += response.data_length
+                    yield response.data[:response.data_length]
+        except FinishedReadingClosedFileException:
+            return
+        if offset == start:
+            # Nothing more, and the writer didn't say the file was closed.
+            return
+
+
+def read_strokes(transport, file_name, offset=0, disk_id=b'A'):
+    """Yield the strokes in a file on the writer, from the stroke at byte offset on"""
+    for chunk in read_file(transport, file_name, offset, disk_id):
+        yield from Stroke.unpack_many(chunk)
+
+
+def download_file(transport, file_name, path, resume=False, disk_id=b'A'):
+    """Copy a file from the writer to path, returning how many bytes were copied
+
+    With resume, carries on from the end of whatever is already at path,
+    dropping any partial stroke at its end first.
+    """
+    offset = 0
+    mode = 'wb'
+    if resume and os.path.exists(path):
+        offset = os.path.getsize(path) // STROKE_SIZE * STROKE_SIZE
+        mode = 'r+b'
+    copied = 0
+    with open(path, mode) as f:
+        f.truncate(offset)
+        f.seek(offset)
+        for chunk in read_file(transport, file_name, offset, disk_id):
+            f.write(chunk)
+            copied += len(chunk)
+    return copied
@@ -0,0 +1,495 @@
+"""
+Stand-in for a Stenograph writer, to exercise the transports without hardware
+
+EmulatedWriter answers requests the way a writer does and keeps its files,
+growing the realtime file at a steady stroke rate. WiFiEmulator serves it
+over UDP discovery and TCP on localhost, and EmulatedUsbBackend is a pyusb
+backend presenting it as a USB device, to pass to LibusbTransport.
+EmulatedTransport skips the I/O altogether.
+"""
+from array import array
+from collections import deque
+from random import Random
+from struct import Struct
+from threading import Event, Thread
+from time import monotonic, sleep
+import errno
+import socket
+
+from stenograph.latency import TIMESTAMP_TICK
+from stenograph.packet import ErrorType, PacketType, StenoPacket
+from stenograph.reader import REALTIME_FILE
+from stenograph.transport import MachineTransport
+from stenograph.discovery import BATTLE_CRY, MACHINE_RESPONSE
+
+
+_STROKE_STRUCT = Struct('<4BI')
+
+
+class EmulatedWriter:
+    """
+    The files on a writer and how it answers requests, without any I/O
+
+    The realtime file starts with realtime_strokes strokes and gains
+    stroke_rate more a second, with timestamps in writer clock ticks since
+    the writer was created. files maps names of closed files to their
+    contents. Reads larger than max_read are refused, like on a writer.
+    """
+
+    def __init__(self, realtime_strokes=0, stroke_rate=0, files=None,
+                 realtime=True, max_read=0x2000, seed=0, clock=monotonic):
+        """realtime -- whether there is a realtime file, if not opening it fails"""
+        self.stroke_rate = stroke_rate
+        self.files = dict(files or {})
+        self.max_read = max_read
+        self.clock = clock
+        self._random = Random(seed)
+        self._started_at = clock()
+        self._strokes_due = realtime_strokes
+        self.realtime_file = bytearray() if realtime else None
+        self._open_file = None
+        self._open_name = None
+        self.update()
+
+    def make_stroke(self, timestamp):
+        """A random stroke record with the given timestamp"""
+        keys = self._random.getrandbits(24) or 1
+        return _STROKE_STRUCT.pack(
+            0xC0 | keys >> 18, 0xC0 | keys >> 12 & 0x3F, 0xC0 | keys >> 6 & 0x3F, 0xC0 | keys & 0x3F,
+            timestamp & 0xFFFFFFFF,
+        )
+
+    def write_strokes(self, count, timestamp=None):
+        """Add strokes to the realtime file, by default timestamped now"""
+        if self.realtime_file is None:
+            return
+        if timestamp is None:
+            timestamp = int((self.clock() - self._started_at) / TIMESTAMP_TICK)
+        for _ in range(count):
+            self.realtime_file += self.make_stroke(timestamp)
+
+    def update(self):
+        """Add the strokes written since the last update at stroke_rate"""
+        if self.realtime_file is None:
+            return
+        elapsed = self.clock() - self._started_at
+        due = self._strokes_due + int(elapsed * self.stroke_rate)
+        written = len(self.realtime_file) // _STROKE_STRUCT.size
+        if due > written:
+            self.write_strokes(due - written)
+
+    def disconnected(self):
+        """The host went away, closing whatever file it had open"""
+        self._open_file = None
+        self._open_name = None
+
+    def handle_request(self, request):
+        """Return the response packet for a request packet"""
+        self.update()
+        if request.packet_type == PacketType.OPEN_FILE:
+            return self._open(request)
+        if request.packet_type == PacketType.READ_FILE:
+            return self._read(request)
+        return self._error(request, ErrorType.UNABLE_TO_PERFORM)
+
+    @staticmethod
+    def _error(request, error_type):
+        return StenoPacket(
+            sequence_number=request.sequence_number,
+            packet_type=PacketType.ERROR,
+            p1=error_type,
+        )
+
+    def _open(self, request):
+        name = bytes(request.data[:request.data_length]).rstrip(b'\x00')
+        if name == REALTIME_FILE:
+            if self.realtime_file is None:
+                return self._error(request, ErrorType.NO_REALTIME_FILE)
+            self._open_file = self.realtime_file
+        elif name in self.files:
+            self._open_file = self.files[name]
+        else:
+            return self._error(request, ErrorType.FILE_NOT_AVAILABLE)
+        self._open_name = name
+        return StenoPacket(
+            sequence_number=request.sequence_number,
+            packet_type=PacketType.OPEN_FILE,
+        )
+
+    def _read(self, request):
+        if self._open_file is None:
+            return self._error(request, ErrorType.FILE_NOT_AVAILABLE)
+        if request.p2 > self.max_read:
+            return self._error(request, ErrorType.UNABLE_TO_PERFORM)
+        offset, byte_count = request.p1, request.p2
+        if self._open_file is not self.realtime_file and offset >= len(self._open_file):
+            return self._error(request, ErrorType.FINISHED_READING_CLOSED_FILE)
+        return StenoPacket(
+            sequence_number=request.sequence_number,
+            packet_type=PacketType.READ_FILE,
+            data=bytes(self._open_file[offset:offset + byte_count]),
+        )
+
+
+class EmulatedTransport(MachineTransport):
+    """Talks to an EmulatedWriter in the same process, encoding packets but with no I/O"""
+
+    MAX_READ_LIMIT = 0x2000
+
+    def __init__(self, writer=None, pipeline_depth=1, max_read=None):
+        super().__init__(pipeline_depth=pipeline_depth, max_read=max_read)
+        self.writer = writer if writer is not None else EmulatedWriter()
+        self.connected = False
+        self._pending = deque()
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+        self._pending.clear()
+        self.writer.disconnected()
+
+    def send(self, request):
+        assert self.connected, 'cannot write to machine if not connected'
+        self._pending.append(self.writer.handle_request(request).pack())
+
+    def receive(self):
+        assert self.connected, 'cannot read from machine if not connected'
+        return StenoPacket.unpack(self._pending.popleft())
+
+
+class WiFiEmulator:
+    """
+    Serves an EmulatedWriter over Wi-Fi, on localhost by default
+
+    Answers the discovery handshake on discovery_port and accepts one data
+    connection at a time on port, both 0 to pick free ports. Point a
+    WiFiTransport at it with address=emulator.host, port=emulator.port, or
+    with discovery_address and discovery_port to go through discovery.
+
+    latency -- seconds to wait before each response
+
+    split_size -- send responses in pieces of this many bytes, to test framing
+
+    disconnect_every -- drop the connection after this many responses
+
+    downtime -- seconds to ignore new connections for after dropping one
+    """
+
+    def __init__(self, writer=None, host='127.0.0.1', port=0, discovery_port=0,
+                 latency=0, split_size=None, disconnect_every=None, downtime=0):
+        self.writer = writer if writer is not None else EmulatedWriter()
+        self.host = host
+        self.port = port
+        self.discovery_port = discovery_port
+        self.latency = latency
+        self.split_size = split_size
+        self.disconnect_every = disconnect_every
+        self.downtime = downtime
+        self.responses = 0
+        self.connections = 0
+        self._stopped = Event()
+        self._threads = []
+        self._udp = None
+        self._server = None
+
+    def start(self):
+        self._stopped.clear()
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.bind((self.host, self.discovery_port))
+        self._udp.settimeout(0.1)
+        self.discovery_port = self._udp.getsockname()[1]
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(1)
+        self._server.settimeout(0.1)
+        self.port = self._server.getsockname()[1]
+        self._threads = [
+            Thread(target=self._answer_discovery, daemon=True),
+            Thread(target=self._serve, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._udp.close()
+        self._server.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _answer_discovery(self):
+        while not self._stopped.is_set():
+            try:
+                data, address = self._udp.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if data.startswith(BATTLE_CRY.rstrip(b'\x00')):
+                self._udp.sendto(MACHINE_RESPONSE + b'(emulated)', address)
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                connection, _address = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.connections += 1
+            with connection:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.settimeout(0.1)
+                self._handle_connection(connection)
+            self.writer.disconnected()
+            if self.downtime:
+                self._stopped.wait(self.downtime)
+
+    def _receive(self, connection, length):
+        data = bytearray()
+        while len(data) < length:
+            try:
+                received = connection.recv(length - len(data))
+            except socket.timeout:
+                if self._stopped.is_set():
+                    return None
+                continue
+            if not received:
+                return None
+            data += received
+        return data
+
+    def _handle_connection(self, connection):
+        served = 0
+        while not self._stopped.is_set():
+            packet = self._receive(connection, StenoPacket.HEADER_SIZE)
+            if packet is None:
+                return
+            data_length = StenoPacket.peek_data_length(packet)
+            if data_length:
+                data = self._receive(connection, data_length)
+                if data is None:
+                    return
+                packet += data
+            response = self.writer.handle_request(StenoPacket.unpack(packet)).pack()
+            if self.latency:
+                sleep(self.latency)
+            try:
+                self._send(connection, response)
+            except OSError:
+                return
+            self.responses += 1
+            served += 1
+            if self.disconnect_every and served >= self.disconnect_every:
+                return
+
+    def _send(self, connection, response):
+        if not self.split_size:
+            connection.sendall(response)
+            return
+        for start in range(0, len(response), self.split_size):
+            connection.sendall(response[start:start + self.split_size])
+            # Give each piece a chance to arrive on its own.
+            sleep(0.001)
+
+
+class _Descriptor:
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class EmulatedUsbDevice:
+    """
+    An EmulatedWriter plugged in over USB, for EmulatedUsbBackend
+
+    latency -- seconds to wait before each response
+
+    disconnect_every -- unplug after this many responses
+
+    downtime -- seconds to stay unplugged for
+    """
+    VENDOR_ID = 0x112b
+    PRODUCT_ID = 0x0001
+    ENDPOINT_OUT = 0x01
+    ENDPOINT_IN = 0x81
+
+    def __init__(self, writer=None, bus=1, address=1, serial_number='EMULATED',
+                 latency=0, disconnect_every=None, downtime=0, clock=monotonic):
+        self.writer = writer if writer is not None else EmulatedWriter()
+        self.bus = bus
+        self.address = address
+        self.serial_number = serial_number
+        self.latency = latency
+        self.disconnect_every = disconnect_every
+        self.downtime = downtime
+        self.clock = clock
+        self.responses = 0
+        self._served = 0
+        self._unplugged_until = None
+        self._pending = []
+
+    @property
+    def plugged_in(self):
+        if self._unplugged_until is not None and self.clock() >= self._unplugged_until:
+            self._unplugged_until = None
+        return self._unplugged_until is None
+
+    def unplug(self, downtime=None):
+        self._unplugged_until = self.clock() + (self.downtime if downtime is None else downtime)
+        self._pending = []
+        self._served = 0
+        self.writer.disconnected()
+
+    def write(self, data):
+        request = StenoPacket.unpack(bytes(data))
+        self._pending.append(self.writer.handle_request(request).pack())
+
+    def read(self):
+        if not self._pending:
+            return None
+        if self.latency:
+            sleep(self.latency)
+        self.responses += 1
+        self._served += 1
+        response = self._pending.pop(0)
+        if self.disconnect_every and self._served >= self.disconnect_every:
+            self.unplug()
+        return response
+
+    def device_descriptor(self):
+        return _Descriptor(
+            bLength=18, bDescriptorType=1, bcdUSB=0x0200,
+            bDeviceClass=0, bDeviceSubClass=0, bDeviceProtocol=0, bMaxPacketSize0=64,
+            idVendor=self.VENDOR_ID, idProduct=self.PRODUCT_ID, bcdDevice=0x0100,
+            iManufacturer=1, iProduct=2, iSerialNumber=3, bNumConfigurations=1,
+            address=self.address, bus=self.bus, port_number=None, port_numbers=None, speed=None,
+        )
+
+    def string(self, index):
+        return {1: 'Stenograph', 2: 'Emulated writer', 3: self.serial_number}.get(index)
+
+
+class EmulatedUsbBackend:
+    """
+    pyusb backend presenting EmulatedUsbDevices, for LibusbTransport(backend=...)
+
+    Implements just enough of usb.backend.IBackend for pyusb to find the
+    devices, configure them and do bulk transfers and string lookups.
+    """
+
+    def __init__(self, *devices):
+        self.devices = list(devices) or [EmulatedUsbDevice()]
+
+    @staticmethod
+    def _usb_error(message, error_number):
+        from usb.core import USBError
+        return USBError(message, error_number, error_number)
+
+    def _check(self, device):
+        if not device.plugged_in:
+            raise self._usb_error('No such device', errno.ENODEV)
+
+    def enumerate_devices(self):
+        return [device for device in self.devices if device.plugged_in]
+
+    def get_device_descriptor(self, dev):
+        return dev.device_descriptor()
+
+    def get_configuration_descriptor(self, dev, config):
+        if config:
+            raise IndexError('configuration %u' % config)
+        return _Descriptor(
+            bLength=9, bDescriptorType=2, wTotalLength=32, bNumInterfaces=1,
+            bConfigurationValue=1, iConfiguration=0, bmAttributes=0x80, bMaxPower=50,
+            extra_descriptors=[],
+        )
+
+    def get_interface_descriptor(self, dev, intf, alt, config):
+        if intf or alt or config:
+            raise IndexError('interface %u, %u' % (intf, alt))
+        return _Descriptor(
+            bLength=9, bDescriptorType=4, bInterfaceNumber=0, bAlternateSetting=0,
+            bNumEndpoints=2, bInterfaceClass=0xFF, bInterfaceSubClass=0,
+            bInterfaceProtocol=0, iInterface=0, extra_descriptors=[],
+        )
+
+    def get_endpoint_descriptor(self, dev, ep, intf, alt, config):
+        if ep > 1 or intf or alt or config:
+            raise IndexError('endpoint %u' % ep)
+        return _Descriptor(
+            bLength=7, bDescriptorType=5,
+            bEndpointAddress=(dev.ENDPOINT_OUT, dev.ENDPOINT_IN)[ep],
+            bmAttributes=0x02, wMaxPacketSize=512, bInterval=0,
+            bRefresh=0, bSynchAddress=0, extra_descriptors=[],
+        )
+
+    def open_device(self, dev):
+        self._check(dev)
+        return dev
+
+    def close_device(self, dev_handle):
+        pass
+
+    def set_configuration(self, dev_handle, config_value):
+        self._check(dev_handle)
+
+    def get_configuration(self, dev_handle):
+        return 1
+
+    def claim_interface(self, dev_handle, intf):
+        self._check(dev_handle)
+
+    def release_interface(self, dev_handle, intf):
+        pass
+
+    def bulk_write(self, dev_handle, ep, intf, data, timeout):
+        self._check(dev_handle)
+        dev_handle.write(data)
+        return len(data)
+
+    def bulk_read(self, dev_handle, ep, intf, buff, timeout):
+        self._check(dev_handle)
+        response = dev_handle.read()
+        if response is None:
+            raise self._usb_error('Operation timed out', errno.ETIMEDOUT)
+        if len(response) > len(buff):
+            raise self._usb_error('Overflow', errno.EOVERFLOW)
+        buff[:len(response)] = array('B', response)
+        return len(response)
+
+    def _unsupported(self, *args):
+        # Writers only have bulk endpoints, which stall anything else.
+        raise self._usb_error('Pipe error', errno.EPIPE)
+
+    # pyusb looks these up along with the bulk ones.
+    intr_write = intr_read = iso_write = iso_read = _unsupported
+
+    def ctrl_transfer(self, dev_handle, bmRequestType, bRequest, wValue, wIndex, data, timeout):
+        self._check(dev_handle)
+        descriptor_type, index = wValue >> 8, wValue & 0xFF
+        # Only GET_DESCRIPTOR for strings, which is all pyusb needs for serial numbers.
+        if bRequest != 6 or descriptor_type != 3:
+            raise self._usb_error('Pipe error', errno.EPIPE)
+        if index == 0:
+            descriptor = b'\x04\x03\x09\x04'  # English (US) only
+        else:
+            string = dev_handle.string(index)
+            if string is None:
+                raise self._usb_error('Pipe error', errno.EPIPE)
+            encoded = string.encode('utf-16-le')
+            descriptor = bytes((len(encoded) + 2, 3)) + encoded
+        descriptor = descriptor[:len(data)]
+        data[:len(descriptor)] = array('B', descriptor)
+        return len(descriptor)
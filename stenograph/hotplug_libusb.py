@@ -0,0 +1,129 @@
+"""
+libusb hotplug notifications, through ctypes on pyusb's libusb1 backend
+
+pyusb has no hotplug API, but its libusb1 backend exposes the loaded
+library as `lib` and its context as `ctx`, which is all libusb's own
+hotplug API needs.
+"""
+from threading import Event, Thread
+import ctypes
+
+
+LIBUSB_CAP_HAS_HOTPLUG = 0x0001
+LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED = 0x01
+LIBUSB_HOTPLUG_ENUMERATE = 0x01
+LIBUSB_HOTPLUG_MATCH_ANY = -1
+
+# How long each libusb_handle_events call blocks, which bounds stop().
+EVENT_TIMEOUT = 0.25
+
+_hotplug_callback_fn = ctypes.CFUNCTYPE(
+    ctypes.c_int,     # Return 0 to stay registered
+    ctypes.c_void_p,  # libusb_context *ctx
+    ctypes.c_void_p,  # libusb_device *device
+    ctypes.c_int,     # libusb_hotplug_event event
+    ctypes.c_void_p,  # void *user_data
+)
+
+
+class _timeval(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec', ctypes.c_long),
+        ('tv_usec', ctypes.c_long),
+    ]
+
+
+def _hotplug_library(backend):
+    """Return backend's libusb if it supports hotplug, otherwise None"""
+    lib = getattr(backend, 'lib', None)
+    if getattr(backend, 'ctx', None) is None or lib is None:
+        return None
+    try:
+        lib.libusb_has_capability.argtypes = [ctypes.c_uint32]
+        lib.libusb_has_capability.restype = ctypes.c_int
+        if not lib.libusb_has_capability(LIBUSB_CAP_HAS_HOTPLUG):
+            return None
+        lib.libusb_hotplug_register_callback.argtypes = [
+            ctypes.c_void_p,                 # ctx
+            ctypes.c_int,                    # events
+            ctypes.c_int,                    # flags
+            ctypes.c_int,                    # vendor_id
+            ctypes.c_int,                    # product_id
+            ctypes.c_int,                    # dev_class
+            _hotplug_callback_fn,            # cb_fn
+            ctypes.c_void_p,                 # user_data
+            ctypes.POINTER(ctypes.c_int),    # callback_handle
+        ]
+        lib.libusb_hotplug_register_callback.restype = ctypes.c_int
+        lib.libusb_hotplug_deregister_callback.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.libusb_hotplug_deregister_callback.restype = None
+        lib.libusb_handle_events_timeout_completed.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(_timeval), ctypes.POINTER(ctypes.c_int),
+        ]
+        lib.libusb_handle_events_timeout_completed.restype = ctypes.c_int
+    except AttributeError:
+        # libusb older than 1.0.16
+        return None
+    return lib
+
+
+class HotplugMonitor:
+    """
+    Sets `arrived` whenever a device with vendor_id is plugged in
+
+    Devices already plugged in when it starts count as arriving. Create
+    with HotplugMonitor.create(), which returns None when the backend
+    can't do hotplug. A thread handles libusb events from start() until
+    stop().
+    """
+
+    def __init__(self, backend, lib, vendor_id):
+        self._ctx = backend.ctx
+        self._lib = lib
+        self.vendor_id = vendor_id
+        self.arrived = Event()
+        self._stopped = Event()
+        self._thread = None
+        self._handle = None
+        # Must outlive the registration, or libusb calls freed memory.
+        self._callback = _hotplug_callback_fn(self._on_hotplug)
+
+    @staticmethod
+    def create(backend, vendor_id):
+        lib = _hotplug_library(backend)
+        if lib is None:
+            return None
+        return HotplugMonitor(backend, lib, vendor_id)
+
+    def _on_hotplug(self, ctx, device, event, user_data):
+        self.arrived.set()
+        return 0
+
+    def start(self):
+        handle = ctypes.c_int()
+        status = self._lib.libusb_hotplug_register_callback(
+            self._ctx, LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED, LIBUSB_HOTPLUG_ENUMERATE,
+            self.vendor_id, LIBUSB_HOTPLUG_MATCH_ANY, LIBUSB_HOTPLUG_MATCH_ANY,
+            self._callback, None, ctypes.byref(handle),
+        )
+        if status:
+            return False
+        self._handle = handle.value
+        self._stopped.clear()
+        self._thread = Thread(target=self._handle_events, daemon=True)
+        self._thread.start()
+        return True
+
+    def _handle_events(self):
+        timeout = _timeval(0, int(EVENT_TIMEOUT * 1000000))
+        while not self._stopped.is_set():
+            self._lib.libusb_handle_events_timeout_completed(self._ctx, ctypes.byref(timeout), None)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._lib.libusb_hotplug_deregister_callback(self._ctx, self._handle)
+        self._thread.join()
+        self._thread = None
+        self._handle = None
@@ -0,0 +1,174 @@
+from bisect import bisect_left
+
+
+# Writer timestamps are a 32-bit count of milliseconds.
+TIMESTAMP_TICK = 0.001
+_TIMESTAMP_WRAP = 1 << 32
+
+
+class WriterClock:
+    """
+    Estimates when a stroke was written in terms of the host's clock
+
+    Every stroke seen is an observation of (writer timestamp, host time it
+    arrived). The offset between the clocks is taken as the smallest
+    difference seen, i.e. from the stroke that reached us fastest. Times
+    estimated from it are therefore at most that fastest delivery time too
+    early, which is a lower bound on the real latency rather than an
+    overestimate. Call reset() when the writer may have restarted its clock.
+    """
+
+    def __init__(self, tick=TIMESTAMP_TICK):
+        self.tick = tick
+        self.reset()
+
+    def reset(self):
+        self.offset = None
+        self._last_timestamp = None
+        self._wraps = 0
+
+    def _unwrap(self, timestamp):
+        last = self._last_timestamp
+        if last is not None and timestamp < last and last - timestamp > _TIMESTAMP_WRAP // 2:
+            self._wraps += 1
+        self._last_timestamp = timestamp
+        return timestamp + self._wraps * _TIMESTAMP_WRAP
+
+    def observe(self, timestamp, received_at):
+        """Record that a stroke with this writer timestamp arrived at host time received_at"""
+        offset = received_at - self._unwrap(timestamp) * self.tick
+        if self.offset is None or offset < self.offset:
+            self.offset = offset
+
+    def host_time(self, timestamp):
+        """Estimated host time a stroke with this writer timestamp was written, or None"""
+        if self.offset is None:
+            return None
+        wraps = self._wraps
+        if self._last_timestamp is not None and timestamp > self._last_timestamp + _TIMESTAMP_WRAP // 2:
+            # Written just before the last wrap.
+            wraps -= 1
+        return (timestamp + wraps * _TIMESTAMP_WRAP) * self.tick + self.offset
+
+
+class LatencyHistogram:
+    """Counts durations in roughly logarithmic buckets, cheap enough to record every stroke"""
+
+    # Bucket upper bounds, in seconds. Anything slower lands in a final overflow bucket.
+    BOUNDS = (
+        0.001, 0.002, 0.005, 0.010, 0.020, 0.030, 0.050, 0.075,
+        0.100, 0.150, 0.200, 0.300, 0.500, 0.750, 1.0, 2.0, 5.0,
+    )
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, duration):
+        self.counts[bisect_left(self.bounds, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile, or None if empty"""
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def buckets(self):
+        """List of (upper bound, count), the last bound being None for the overflow bucket"""
+        return list(zip(self.bounds + (None,), self.counts))
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class RttEstimator:
+    """
+    Smoothed round-trip time and its variation, giving a timeout for the next request
+
+    As in TCP (RFC 6298): the timeout is the smoothed RTT plus four times
+    the mean deviation, kept within min_timeout and max_timeout. Until the
+    first sample it is max_timeout. Each timeout doubles it until the next
+    sample, so a writer that is only slow gets longer to answer after a
+    reconnect.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, min_timeout, max_timeout):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.reset()
+
+    def reset(self):
+        self.srtt = None
+        self.rttvar = None
+        self._backoff = 1
+        self.timeout = self.max_timeout
+
+    def set_bounds(self, min_timeout, max_timeout):
+        if min_timeout > max_timeout:
+            raise ValueError('min_timeout %r is more than max_timeout %r' % (min_timeout, max_timeout))
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._update()
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self._backoff = 1
+        self._update()
+
+    def timed_out(self):
+        """Record that a request got no answer within timeout"""
+        self._backoff *= 2
+        self._update()
+
+    def _update(self):
+        if self.srtt is None:
+            self.timeout = self.max_timeout
+            return
+        timeout = max(self.srtt + 4 * self.rttvar, self.min_timeout) * self._backoff
+        self.timeout = min(timeout, self.max_timeout)
+
+    def summary(self):
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'timeout': self.timeout,
+        }
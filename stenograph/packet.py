@@ -1,13 +1,16 @@
 from enum import IntEnum
-from struct import Struct, calcsize, pack, unpack
-from more_itertools import grouper
-from itertools import compress
+from struct import Struct, calcsize
 
-from stenograph.stroke import Stroke
+from stenograph.stroke import Stroke, STROKE_SIZE
+from stenograph.exception import ProtocolViolationException
 
 MAX_READ = 0x200  # Arbitrary read limit
 
 
+def _hex(value):
+    return hex(value) if value is not None else None
+
+
 class PacketType(IntEnum):
     ERROR = 0x6
     OPEN_FILE = 0x11
@@ -38,15 +41,14 @@ class StenoPacket:
     _STRUCT_FORMAT = '<2sIH6I'
     HEADER_SIZE = calcsize(_STRUCT_FORMAT)
     _STRUCT = Struct(_STRUCT_FORMAT)
-
-
-    sequence_number = 0
+    # Just the sync and data length, for framing a byte stream.
+    _FRAME_STRUCT = Struct('<2s6xI')
 
     def __init__(self, sequence_number=None, packet_type=0, data_length=None,
                  p1=0, p2=0, p3=0, p4=0, p5=0, data=b''):
         """Create a USB Packet
 
-        sequence_number -- ideally unique, if not passed one will be assigned sequentially.
+        sequence_number -- ideally unique, if not passed the transport assigns one when sending.
 
         packet_type -- type of packet.
 
@@ -56,9 +58,6 @@ class StenoPacket:
 
         data -- data to be appended to the end of the packet, used for steno strokes from the writer.
         """
-        if sequence_number is None:
-            sequence_number = StenoPacket.sequence_number
-            StenoPacket._increment_sequence_number()
         if data is not None:
             # Data is padded to 8 bytes
             remainder = len(data) % 8
@@ -81,39 +80,55 @@ class StenoPacket:
             'StenoPacket(sequence_number=%s, '
             'packet_type=%s(%s), data_length=%s, '
             'p1=%s, p2=%s, p3=%s, p4=%s, p5=%s, data=%s)'
-            % (hex(self.sequence_number), hex(self.packet_type), self.packet_type.name,
+            % (_hex(self.sequence_number), hex(self.packet_type), self.packet_type.name,
                self.data_length, hex(self.p1), hex(self.p2),
                hex(self.p3), hex(self.p4), hex(self.p5),
-               self.data[:self.data_length])
+               bytes(self.data[:self.data_length]))
         )
 
     def pack(self):
         """Convert this USB Packet into something that can be sent to the writer."""
+        if self.sequence_number is None:
+            raise ValueError('%s has no sequence number yet, the transport sets it' % self)
         return self._STRUCT.pack(
             self._SYNC, self.sequence_number, self.packet_type, self.data_length,
             self.p1, self.p2, self.p3, self.p4, self.p5
-        ) + (
-            pack('%ss' % len(self.data), self.data)
-        )
-
-    @staticmethod
-    def _increment_sequence_number():
-        StenoPacket.sequence_number = (StenoPacket.sequence_number + 1) % 0xFFFFFFFF
+        ) + bytes(self.data)
 
     @staticmethod
     def unpack(usb_packet):
-        """Create a USBPacket from raw data"""
-        packet = StenoPacket(
-            # Drop sync when unpacking.
-            *StenoPacket._STRUCT.unpack(usb_packet[:StenoPacket.HEADER_SIZE])[1:]
-        )
-        if packet.data_length:
-            packet.data, = unpack(
-                '%ss' % packet.data_length,
-                usb_packet[StenoPacket.HEADER_SIZE:StenoPacket.HEADER_SIZE + packet.data_length]
-            )
+        """Create a USBPacket from raw data
+
+        usb_packet may be any buffer. The packet's data is a memoryview over
+        it rather than a copy, so it is only valid until the buffer is reused.
+        """
+        view = memoryview(usb_packet)
+        if view.format != 'B':
+            view = view.cast('B')
+        (_sync, sequence_number, packet_type, data_length,
+         p1, p2, p3, p4, p5) = StenoPacket._STRUCT.unpack_from(view)
+        # Bypass __init__, incoming data is already padded.
+        packet = StenoPacket.__new__(StenoPacket)
+        packet.sequence_number = sequence_number
+        packet.packet_type = PacketType(packet_type)
+        packet.data_length = data_length
+        packet.p1 = p1
+        packet.p2 = p2
+        packet.p3 = p3
+        packet.p4 = p4
+        packet.p5 = p5
+        header_size = StenoPacket.HEADER_SIZE
+        packet.data = view[header_size:header_size + data_length]
         return packet
 
+    @staticmethod
+    def peek_data_length(header):
+        """Return the data length from a packet header, checking its sync bytes"""
+        sync, data_length = StenoPacket._FRAME_STRUCT.unpack_from(header)
+        if sync != StenoPacket._SYNC:
+            raise ProtocolViolationException('bad sync bytes %r' % sync)
+        return data_length
+
     @staticmethod
     def make_open_request(file_name=b'REALTIME.000', disk_id=b'A'):
         """Request to open a file on the writer, defaults to the realtime file."""
@@ -144,11 +159,65 @@ class StenoPacket:
         """Get list of strokes represented in this packet's data"""
 
         # Expecting 8-byte chords (4 bytes of steno, 4 of timestamp.)
-        assert self.data_length % 8 == 0
+        assert self.data_length % STROKE_SIZE == 0
         # Steno should only be present on ACTION_READ packets
         assert self.packet_type == PacketType.READ_FILE
 
-        return [
-            Stroke.unpack(stroke_data)
-            for stroke_data in grouper(self.data, 8, fillvalue=0)
-        ]
+        return Stroke.unpack_many(self.data[:self.data_length])
+
+
+class ReadRequest:
+    """
+    Reusable READ_FILE request, encoded in place
+
+    Looks like a StenoPacket to the transports, but keeps its header in one
+    preallocated buffer. prepare() only rewrites the offset and byte count,
+    and setting sequence_number only rewrites that, so polling builds no
+    new objects.
+    """
+    packet_type = PacketType.READ_FILE
+    data_length = 0
+    data = b''
+    p3 = p4 = p5 = 0
+
+    # Field offsets within the header, see StenoPacket._STRUCT_FORMAT.
+    _SEQUENCE_STRUCT = Struct('<I')
+    _SEQUENCE_OFFSET = 2
+    _PARAMS_STRUCT = Struct('<II')
+    _PARAMS_OFFSET = 12
+
+    def __init__(self):
+        self._buffer = bytearray(StenoPacket.HEADER_SIZE)
+        StenoPacket._STRUCT.pack_into(
+            self._buffer, 0, StenoPacket._SYNC, 0, PacketType.READ_FILE, 0, 0, 0, 0, 0, 0)
+        self._sequence_number = None
+        self.p1 = 0
+        self.p2 = 0
+
+    def __str__(self):
+        return (
+            'ReadRequest(sequence_number=%s, p1=%s, p2=%s)'
+            % (_hex(self.sequence_number), hex(self.p1), hex(self.p2))
+        )
+
+    @property
+    def sequence_number(self):
+        return self._sequence_number
+
+    @sequence_number.setter
+    def sequence_number(self, sequence_number):
+        self._sequence_number = sequence_number
+        self._SEQUENCE_STRUCT.pack_into(self._buffer, self._SEQUENCE_OFFSET, sequence_number)
+
+    def prepare(self, file_offset, byte_count=MAX_READ):
+        """Re-encode for the next read, leaving the sequence number to the transport"""
+        self.p1 = file_offset
+        self.p2 = byte_count
+        self._PARAMS_STRUCT.pack_into(self._buffer, self._PARAMS_OFFSET, file_offset, byte_count)
+        return self
+
+    def pack(self):
+        """The encoded request, which is overwritten by the next prepare()"""
+        if self._sequence_number is None:
+            raise ValueError('%s has no sequence number yet, the transport sets it' % self)
+        return self._buffer
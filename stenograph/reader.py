@@ -0,0 +1,145 @@
+from stenograph.packet import PacketType, ReadRequest, StenoPacket
+from stenograph.scheduler import AdaptivePollScheduler
+from stenograph.seek import EndOfFileSeeker
+from stenograph.stroke import STROKE_SIZE
+
+
+REALTIME_FILE = b'REALTIME.000'
+
+
+class RealtimeReader:
+    """
+    Open/read state machine for following the writer's realtime file
+
+    Does no I/O itself, so blocking and asyncio loops can share it: send the
+    packet from next_request(), pass the response to handle_response(), then
+    wait `delay` seconds before the next request. Call reset() on any error
+    that means the file has to be opened again.
+
+    With fast_forward, strokes already in the file are skipped by seeking to
+    its end instead of reading through them.
+
+    After disconnected(), reading resumes where it left off if the file is
+    still the same one, delivering the strokes written in the meantime. The
+    file counts as the same if its first stroke and the last one we read
+    are unchanged.
+    """
+
+    def __init__(self, scheduler=None, file_name=REALTIME_FILE, fast_forward=True):
+        if scheduler is None:
+            scheduler = AdaptivePollScheduler()
+        self.scheduler = scheduler
+        self.file_name = file_name
+        self.fast_forward = fast_forward
+        self._read_request = ReadRequest()
+        self.reset()
+
+    def reset(self):
+        self.realtime = False  # Not realtime until we get a 0-length response
+        self.file_open = False  # We are reading from a file
+        self.offset = 0  # File offset to read from
+        self.delay = 0  # Seconds to wait before the next request
+        self._seeker = None  # Looking for the end of the file
+        self._seeker_last_end = None  # Where the last seeker probe with data ended
+        self._behind = False  # Realtime, but strokes were written while disconnected
+        self._first_record = None  # First stroke record in the file, once seen
+        self._last_record = None  # Stroke record just before offset, once seen
+        self._resume_point = None  # (offset, first record, last record) to resume from
+        self._checks = []  # (offset, record) still to confirm before resuming
+
+    @property
+    def catching_up(self):
+        """The file is open but we have not reached its end yet"""
+        return (self.file_open and (self._behind or not self.realtime) and
+                self._seeker is None and not self._checks)
+
+    def disconnected(self):
+        """The connection dropped; the user could start a new file meanwhile"""
+        resume_point = self._resume_point
+        if self.realtime and self._first_record is not None and self._last_record is not None:
+            resume_point = (self.offset, self._first_record, self._last_record)
+        self.reset()
+        self._resume_point = resume_point
+        self.scheduler.reset()
+
+    def next_request(self):
+        if not self.file_open:
+            return StenoPacket.make_open_request(file_name=self.file_name)
+        if self._checks:
+            return self._read_request.prepare(self._checks[0][0], STROKE_SIZE)
+        if self._seeker is not None:
+            return self._seeker.next_request()
+        return self._read_request.prepare(self.offset)
+
+    def _start_reading(self):
+        """Read the file we just opened from the start, or its end with fast_forward"""
+        if self.fast_forward:
+            self._seeker = EndOfFileSeeker(request=self._read_request)
+
+    def _check_response(self, response):
+        """Confirm one record of the file we are resuming, or give up on resuming"""
+        check_offset, record = self._checks.pop(0)
+        if bytes(response.data[:response.data_length]) != record:
+            # A different file, start over.
+            self._checks = []
+            self._resume_point = None
+            self._start_reading()
+            return
+        if not self._checks:
+            self.offset, self._first_record, self._last_record = self._resume_point
+            self._resume_point = None
+            self.realtime = True
+            self._behind = True
+
+    def handle_response(self, response):
+        """Consume a response and return the strokes to deliver from it"""
+        self.delay = 0
+        if response.packet_type == PacketType.OPEN_FILE:
+            self.file_open = True
+            if self._resume_point is not None:
+                offset, first_record, last_record = self._resume_point
+                self._checks = [(0, first_record)]
+                if offset > STROKE_SIZE:
+                    self._checks.append((offset - STROKE_SIZE, last_record))
+            else:
+                self._start_reading()
+            return []
+
+        if self._checks:
+            self._check_response(response)
+            return []
+
+        data_length = response.data_length
+        if self._seeker is not None:
+            if data_length:
+                # Keep the records needed to resume from whatever the end turns out to be.
+                probe_offset = self._seeker.offset
+                if not probe_offset:
+                    self._first_record = bytes(response.data[:STROKE_SIZE])
+                self._last_record = bytes(response.data[data_length - STROKE_SIZE:data_length])
+                self._seeker_last_end = probe_offset + data_length
+            end = self._seeker.handle_response(response)
+            if end is not None:
+                # Carry on reading normally from the end.
+                self.offset = end
+                self._seeker = None
+                if end != self._seeker_last_end:
+                    self._last_record = None
+            return []
+
+        strokes = []
+        if data_length:
+            if not self.offset:
+                self._first_record = bytes(response.data[:STROKE_SIZE])
+            self._last_record = bytes(response.data[data_length - STROKE_SIZE:data_length])
+            self.offset += data_length
+            # Strokes before we caught up were written before we connected.
+            if self.realtime:
+                strokes = response.strokes()
+        elif not self.realtime:
+            self.realtime = True
+        else:
+            self._behind = False
+        if self.realtime and not self._behind:
+            self.delay = self.scheduler.next_interval(data_length)
+        return strokes
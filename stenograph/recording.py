@@ -0,0 +1,180 @@
+"""
+Recording and replaying the raw traffic between a transport and a writer
+
+A traffic log is a short header followed by records, each a kind byte, a
+monotonic timestamp and the length of the packet bytes that follow it. It
+is only ever appended to. Records are buffered and written out on each
+disconnect and on close, so a crash loses at most the last buffer's worth.
+"""
+from struct import Struct
+from time import monotonic, sleep
+import mmap
+import os
+
+from stenograph.packet import StenoPacket
+from stenograph.transport import MachineTransport
+from stenograph.exception import ConnectionError, ProtocolViolationException
+
+
+LOG_HEADER = b'SGLOG\x01'
+
+REQUEST = 1
+RESPONSE = 2
+DISCONNECT = 3  # The connection failed, no packet
+
+_RECORD_STRUCT = Struct('<BdI')
+
+# Bytes of records to collect before writing them out.
+RECORD_BUFFER_SIZE = 0x10000
+
+
+class TrafficRecorder:
+    """Appends requests and responses to a traffic log, set as a transport's recorder"""
+
+    def __init__(self, path, clock=monotonic):
+        self.path = path
+        self.clock = clock
+        self._file = open(path, 'ab', buffering=RECORD_BUFFER_SIZE)
+        if not self._file.tell():
+            self._file.write(LOG_HEADER)
+
+    def _write(self, kind, packet=b''):
+        self._file.write(_RECORD_STRUCT.pack(kind, self.clock(), len(packet)))
+        self._file.write(packet)
+
+    def request(self, request):
+        self._write(REQUEST, request.pack())
+
+    def response(self, response):
+        self._write(RESPONSE, response.pack())
+
+    def disconnect(self):
+        self._write(DISCONNECT)
+        # Get an incident onto disk while the connection is down anyway.
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_records(buffer):
+    """Yield (kind, timestamp, packet bytes) for each record in a traffic log buffer
+
+    The packet bytes are a view over the buffer.
+    """
+    view = memoryview(buffer)
+    if bytes(view[:len(LOG_HEADER)]) != LOG_HEADER:
+        raise ProtocolViolationException('not a traffic log')
+    offset = len(LOG_HEADER)
+    end = len(view)
+    while offset + _RECORD_STRUCT.size <= end:
+        kind, timestamp, length = _RECORD_STRUCT.unpack_from(view, offset)
+        offset += _RECORD_STRUCT.size
+        if offset + length > end:
+            # Cut off mid-record.
+            return
+        yield kind, timestamp, view[offset:offset + length]
+        offset += length
+
+
+class ReplayTransport(MachineTransport):
+    """
+    Plays a traffic log back in place of a writer
+
+    Hands out the recorded sequence numbers and answers each request with
+    the recorded response, so a StenographMachine sees exactly the traffic
+    that was recorded. With speed, responses are held back until their
+    recorded time, scaled by speed, since the replay started; with
+    speed=None they come as fast as they are asked for. Recorded
+    disconnects raise ConnectionError again, and so does running out of
+    log, after which `finished` is set.
+
+    The requests have to come in the recorded order, so pipeline_depth and
+    max_read should match those of the transport that was recorded.
+    """
+
+    def __init__(self, path, speed=1.0, pipeline_depth=1, max_read=None, clock=monotonic):
+        super().__init__(pipeline_depth=pipeline_depth, max_read=max_read)
+        self.path = path
+        self.speed = speed
+        self.clock = clock
+        self.finished = False
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = LOG_HEADER
+        self._records = read_records(self._buffer)
+        self._next = None
+        self._first_timestamp = None
+        self._started_at = None
+        self._connected = False
+
+    def close(self):
+        """Unmap the traffic log, once the packets received from it are dropped"""
+        self._records.close()
+        self._records = read_records(LOG_HEADER)
+        self._next = None
+        self.finished = True
+        self._connected = False
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = LOG_HEADER
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _peek(self):
+        if self._next is None:
+            self._next = next(self._records, None)
+            if self._next is None:
+                self.finished = True
+                self._connected = False
+                raise ConnectionError('End of traffic log')
+        return self._next
+
+    def _pop(self, kind):
+        record = self._peek()
+        if record[0] == DISCONNECT:
+            self._next = None
+            self._connected = False
+            raise ConnectionError('Recorded disconnect')
+        if record[0] != kind:
+            raise ProtocolViolationException('Replay no longer matches the traffic log')
+        self._next = None
+        return record
+
+    def connect(self):
+        if self.finished:
+            raise ConnectionError('End of traffic log')
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def next_sequence_number(self):
+        kind, _timestamp, packet = self._peek()
+        if kind == REQUEST:
+            return StenoPacket.unpack(packet).sequence_number
+        return super().next_sequence_number()
+
+    def send(self, request):
+        assert self._connected, 'cannot write to machine if not connected'
+        _kind, _timestamp, packet = self._pop(REQUEST)
+        if StenoPacket.unpack(packet).packet_type != request.packet_type:
+            raise ProtocolViolationException('Replay no longer matches the traffic log')
+
+    def receive(self):
+        assert self._connected, 'cannot read from machine if not connected'
+        _kind, timestamp, packet = self._pop(RESPONSE)
+        if self.speed:
+            now = self.clock()
+            if self._started_at is None:
+                self._first_timestamp, self._started_at = timestamp, now
+            delay = self._started_at + (timestamp - self._first_timestamp) / self.speed - now
+            if delay > 0:
+                sleep(delay)
+        return StenoPacket.unpack(packet)
@@ -0,0 +1,59 @@
+class PollScheduler:
+    """Decides how long to wait between realtime polls of the writer"""
+
+    def reset(self):
+        """Forget any history, e.g. after reconnecting to the writer"""
+        pass
+
+    def next_interval(self, data_length):
+        """Return the number of seconds to wait after a read of data_length bytes"""
+        raise NotImplementedError('next_interval() is not implemented')
+
+
+class FixedPollScheduler(PollScheduler):
+    """Always waits the same amount of time between polls"""
+
+    def __init__(self, interval=0.10):
+        self.interval = interval
+
+    def next_interval(self, data_length):
+        return self.interval
+
+
+class AdaptivePollScheduler(PollScheduler):
+    """
+    Polls quickly while strokes are arriving and backs off as the writer goes idle
+
+    Right after a non-empty read the interval drops to min_interval. Each
+    empty read after the first idle_polls grows it by backoff, up to
+    max_interval.
+    """
+
+    MIN_INTERVAL = 0.02
+    MAX_INTERVAL = 0.10
+    BACKOFF = 1.5
+    IDLE_POLLS = 5
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, idle_polls=IDLE_POLLS):
+        if min_interval > max_interval:
+            raise ValueError('min_interval must not exceed max_interval')
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.idle_polls = idle_polls
+        self.reset()
+
+    def reset(self):
+        self._interval = self.min_interval
+        self._empty_polls = 0
+
+    def next_interval(self, data_length):
+        if data_length:
+            self._interval = self.min_interval
+            self._empty_polls = 0
+        else:
+            self._empty_polls += 1
+            if self._empty_polls > self.idle_polls:
+                self._interval = min(self._interval * self.backoff, self.max_interval)
+        return self._interval
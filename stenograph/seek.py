@@ -0,0 +1,56 @@
+from stenograph.packet import MAX_READ, ReadRequest
+from stenograph.stroke import STROKE_SIZE
+
+
+class EndOfFileSeeker:
+    """
+    Finds the current end of an open file in O(log n) reads
+
+    Probes exponentially growing offsets (0, 1, 3, 7, 15... probe_sizes)
+    until one is past the end, then binary searches between the last offset
+    with data and that one. Each probe reads probe_size bytes, so any short read
+    gives the end exactly.
+
+    Like RealtimeReader this does no I/O: send next_request() and pass the
+    response to handle_response() until `end` is set.
+    """
+
+    def __init__(self, probe_size=MAX_READ, request=None):
+        """request -- ReadRequest to reuse for the probes"""
+        self.probe_size = probe_size
+        self._request = request if request is not None else ReadRequest()
+        self.end = None
+        self.probes = 0
+        self._low = 0  # The file has data up to here
+        self._high = None  # The file has no data from here, once we know
+        self.offset = 0  # Offset of the probe in flight
+
+    def next_request(self):
+        low, high = self._low, self._high
+        if high is None:
+            # Double until we overshoot.
+            offset = low * 2 - self.probe_size if low else 0
+            offset = max(offset, low)
+        elif high - low <= self.probe_size:
+            offset = low
+        else:
+            offset = low + (high - low) // 2 // STROKE_SIZE * STROKE_SIZE
+        self.offset = offset
+        return self._request.prepare(offset, self.probe_size)
+
+    def handle_response(self, response):
+        """Narrow the search with a probe's response, returning the end once found"""
+        self.probes += 1
+        offset, data_length = self.offset, response.data_length
+        if data_length == self.probe_size:
+            self._low = offset + data_length
+            if self._high is not None and self._low >= self._high:
+                # The file grew while we were looking.
+                self._high = None
+        elif data_length:
+            self.end = offset + data_length
+        elif offset == self._low:
+            self.end = offset
+        else:
+            self._high = offset
+        return self.end
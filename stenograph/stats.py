@@ -0,0 +1,69 @@
+from collections import Counter
+
+from stenograph.latency import LatencyHistogram
+from stenograph.packet import PacketType
+
+
+class TransportStats:
+    """
+    Counters and timers for the polling hot path
+
+    Each update is a few attribute increments, cheap enough to leave on in
+    production. Transports record requests and responses; whoever drives
+    the transport records strokes, exceptions and disconnects.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.rtt = LatencyHistogram()  # Request round-trip times, in seconds
+        self.empty_reads = 0
+        self.data_reads = 0
+        self.bytes_read = 0
+        self.strokes_read = 0
+        self.exceptions = Counter()  # Exception type name -> count
+        self.reconnects = 0
+        self.disconnected_time = 0.0  # Seconds spent disconnected, not counting now
+        self._disconnected_at = None
+
+    def record_response(self, response, rtt):
+        self.requests += 1
+        self.rtt.record(rtt)
+        if response.packet_type == PacketType.READ_FILE:
+            if response.data_length:
+                self.data_reads += 1
+                self.bytes_read += response.data_length
+            else:
+                self.empty_reads += 1
+
+    def record_exception(self, exception):
+        self.exceptions[type(exception).__name__] += 1
+
+    def record_disconnect(self, now):
+        if self._disconnected_at is None:
+            self._disconnected_at = now
+
+    def record_reconnect(self, now):
+        self.reconnects += 1
+        if self._disconnected_at is not None:
+            self.disconnected_time += now - self._disconnected_at
+            self._disconnected_at = None
+
+    def snapshot(self, now):
+        """Current values as a plain dict"""
+        disconnected_time = self.disconnected_time
+        if self._disconnected_at is not None:
+            disconnected_time += now - self._disconnected_at
+        return {
+            'requests': self.requests,
+            'rtt': self.rtt.summary(),
+            'empty_reads': self.empty_reads,
+            'data_reads': self.data_reads,
+            'bytes_read': self.bytes_read,
+            'strokes_read': self.strokes_read,
+            'exceptions': dict(self.exceptions),
+            'reconnects': self.reconnects,
+            'disconnected_time': disconnected_time,
+        }
@@ -1,4 +1,5 @@
 from itertools import compress
+from struct import Struct
 
 STENO_KEY_CHART = (
     ('^', '#', 'S-', 'T-', 'K-', 'P-'),
@@ -7,19 +8,84 @@ STENO_KEY_CHART = (
     ('-L', '-G', '-T', '-S', '-D', '-Z'),
 )
 
+# Each steno byte carries 6 keys in its low bits, most significant first.
+# A stroke is kept as a single 24-bit mask with the first chart row in the
+# high bits, so key n of the flattened chart is bit (23 - n).
+_ROW_BITS = 6
+_ROW_MASK = (1 << _ROW_BITS) - 1
+
+# Per chart row, the mask contribution of each possible steno byte.
+_BYTE_TO_MASK = tuple(
+    tuple((steno_byte & _ROW_MASK) << (_ROW_BITS * (3 - row)) for steno_byte in range(256))
+    for row in range(len(STENO_KEY_CHART))
+)
+
+# Per chart row, the key names for each possible 6-bit value.
+_BITS_TO_KEYS = tuple(
+    tuple(
+        tuple(compress(key_chart_row, [(bits >> (5 - i)) & 1 for i in range(_ROW_BITS)]))
+        for bits in range(1 << _ROW_BITS)
+    )
+    for key_chart_row in STENO_KEY_CHART
+)
+
+# A stroke record is 4 steno bytes followed by a 4 byte timestamp.
+_STROKE_STRUCT = Struct('<4BI')
+STROKE_SIZE = _STROKE_STRUCT.size
+
+
 class Stroke:
-    def __init__(self, keys):
-        self.keys = keys
+    __slots__ = ('mask', 'timestamp', '_keys')
+
+    def __init__(self, mask, timestamp=0):
+        self.mask = mask
+        self.timestamp = timestamp  # Writer clock ticks when the stroke was written
+        self._keys = None
 
     def __repr__(self):
         return "Stroke([{0}])".format(", ".join(self.keys))
 
+    @property
+    def keys(self):
+        keys = self._keys
+        if keys is None:
+            mask = self.mask
+            keys = self._keys = (
+                _BITS_TO_KEYS[0][mask >> 18] +
+                _BITS_TO_KEYS[1][(mask >> 12) & _ROW_MASK] +
+                _BITS_TO_KEYS[2][(mask >> 6) & _ROW_MASK] +
+                _BITS_TO_KEYS[3][mask & _ROW_MASK]
+            )
+        return keys
+
+    @staticmethod
+    def from_keys(keys):
+        mask = 0
+        for row, key_chart_row in enumerate(STENO_KEY_CHART):
+            for i, key in enumerate(key_chart_row):
+                if key in keys:
+                    mask |= 1 << (_ROW_BITS * (3 - row) + 5 - i)
+        return Stroke(mask)
+
+    @staticmethod
+    def from_steno_bytes(b0, b1, b2, b3, timestamp=0):
+        # Every steno byte has its top two bits set.
+        assert b0 & b1 & b2 & b3 >= 0b11000000
+        return Stroke(
+            _BYTE_TO_MASK[0][b0] | _BYTE_TO_MASK[1][b1] |
+            _BYTE_TO_MASK[2][b2] | _BYTE_TO_MASK[3][b3],
+            timestamp,
+        )
+
     @staticmethod
     def unpack(stroke_data):
-        keys = []
-        for steno_byte, key_chart_row in zip(stroke_data, STENO_KEY_CHART):
-            assert steno_byte >= 0b11000000
-            # Only interested in right 6 values
-            key_mask = [int(i) for i in bin(steno_byte)[-6:]]
-            keys.extend(compress(key_chart_row, key_mask))
-        return Stroke(keys)
+        return Stroke.from_steno_bytes(*_STROKE_STRUCT.unpack_from(stroke_data))
+
+    @staticmethod
+    def unpack_many(stroke_data):
+        """Decode every stroke record in a buffer whose length is a multiple of STROKE_SIZE"""
+        from_steno_bytes = Stroke.from_steno_bytes
+        return [
+            from_steno_bytes(b0, b1, b2, b3, timestamp)
+            for b0, b1, b2, b3, timestamp in _STROKE_STRUCT.iter_unpack(stroke_data)
+        ]
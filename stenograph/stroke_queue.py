@@ -0,0 +1,71 @@
+from collections import deque
+from threading import Condition
+
+
+class StrokeQueue:
+    """
+    Bounded ring buffer handing strokes from the thread polling the writer
+    to the thread delivering them
+
+    put() never blocks. When the queue is full, the oldest stroke is
+    dropped and counted, so a slow consumer can't hold up polling the
+    writer. get() waits for a stroke, and returns None once the queue is
+    closed and empty.
+    """
+
+    SIZE = 1024
+
+    def __init__(self, size=SIZE):
+        self._items = deque(maxlen=size)
+        self._condition = Condition()
+        self._closed = False
+        self.dropped = 0
+        self.max_depth = 0
+
+    @property
+    def size(self):
+        return self._items.maxlen
+
+    def __len__(self):
+        return len(self._items)
+
+    def open(self):
+        """Accept strokes again after close()"""
+        with self._condition:
+            self._closed = False
+
+    def close(self):
+        """Let get() return None once the queued strokes are taken"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def put(self, item):
+        """Queue item, returning False if the oldest item was dropped to make room"""
+        with self._condition:
+            items = self._items
+            full = len(items) == items.maxlen
+            if full:
+                self.dropped += 1
+            items.append(item)
+            if len(items) > self.max_depth:
+                self.max_depth = len(items)
+            self._condition.notify()
+        return not full
+
+    def get(self):
+        with self._condition:
+            while not self._items:
+                if self._closed:
+                    return None
+                self._condition.wait()
+            return self._items.popleft()
+
+    def summary(self):
+        with self._condition:
+            return {
+                'depth': len(self._items),
+                'max_depth': self.max_depth,
+                'dropped': self.dropped,
+                'size': self.size,
+            }
@@ -1,20 +1,81 @@
-from stenograph.packet import ErrorType
+from threading import Lock
+from time import perf_counter
+
+from stenograph.packet import ErrorType, MAX_READ, PacketType, ReadRequest
+from stenograph.stroke import STROKE_SIZE
+from stenograph.latency import RttEstimator
+from stenograph.stats import TransportStats
 from stenograph.exception import *
 
-class MachineTransport:
-    """Simple interface to connect with and send data to a Stenograph machine"""
+class TransportBase:
+    """
+    What every transport keeps besides its I/O: sequence numbers, stats,
+    timeouts and the checking of responses
 
-    def connect(self):
-        """Connect to machine, raise an exception if an error occurred"""
-        raise NotImplementedError('connect() is not implemented')
+    MachineTransport adds blocking I/O on top, AsyncWiFiTransport asyncio.
+    """
 
-    def disconnect(self):
-        """Disconnect from the machine"""
-        raise NotImplementedError('disconnect() is not implemented')
+    # Largest READ_FILE byte_count this kind of transport handles by default.
+    MAX_READ_LIMIT = MAX_READ
 
-    def send_receive(self, request):
-        """Send a StenoPacket to the machine and return the response"""
-        raise NotImplementedError('send_receive() is not implemented')
+    # Bounds of the receive timeout, which otherwise follows the round-trip times.
+    MIN_TIMEOUT = 0.25
+    MAX_TIMEOUT = 3.0
+
+    def __init__(self, pipeline_depth=1, max_read=None):
+        """pipeline_depth -- how many READ_FILE requests read_pipelined() keeps in flight
+
+        max_read -- largest READ_FILE byte_count to ask the writer for,
+        defaults to MAX_READ_LIMIT, see set_max_read()
+        """
+        self.pipeline_depth = pipeline_depth
+        self.max_read = self._fit_max_read(max_read or self.MAX_READ_LIMIT)
+        self.stats = TransportStats()
+        self.rtt_estimator = RttEstimator(self.MIN_TIMEOUT, self.MAX_TIMEOUT)
+        # Each transport numbers its own requests, so several can run at once.
+        self._sequence_number = 0
+        self._sequence_lock = Lock()
+        # Optional TrafficRecorder, sees every request and response.
+        self.recorder = None
+
+    def next_sequence_number(self):
+        """Allocate the sequence number for the next request, safe to call from any thread"""
+        with self._sequence_lock:
+            sequence_number = self._sequence_number
+            self._sequence_number = (sequence_number + 1) % 0xFFFFFFFF
+        return sequence_number
+
+    @staticmethod
+    def _fit_max_read(max_read):
+        # Whole strokes only, and never less than a realtime poll or seeker probe asks for.
+        return max(MAX_READ, max_read - max_read % STROKE_SIZE)
+
+    def set_max_read(self, max_read):
+        """Change the largest READ_FILE byte_count, resizing receive buffers to match
+
+        max_read is rounded down to whole strokes and raised to at least MAX_READ.
+        """
+        self.max_read = self._fit_max_read(max_read)
+
+    def set_timeout_bounds(self, min_timeout, max_timeout):
+        """Keep the receive timeout within these many seconds"""
+        self.rtt_estimator.set_bounds(min_timeout, max_timeout)
+
+    @property
+    def timeout(self):
+        """Seconds to wait for the next response before giving up on the connection"""
+        return self.rtt_estimator.timeout
+
+    def _record_response(self, response, rtt):
+        self.stats.record_response(response, rtt)
+        self.rtt_estimator.observe(rtt)
+
+    def check_response(self, request, response):
+        """Make sure the response answers the request, then handle it"""
+        if (response.sequence_number == request.sequence_number and
+            (response.packet_type == request.packet_type or response.is_error)):
+            return self.handle_response(response)
+        raise ProtocolViolationException()
 
     def handle_response(self, response):
         """Read the response, and raise an exception if an error occurred"""
@@ -29,3 +90,206 @@ class MachineTransport:
             elif error_type == ErrorType.FINISHED_READING_CLOSED_FILE:
                 raise FinishedReadingClosedFileException
         return response
+
+
+class ReadPipeline:
+    """
+    The bookkeeping of read_pipelined(), without the I/O
+
+    next_request() returns the next READ_FILE request while the window has
+    room. The request object is reused, so send it before asking for the
+    next one. Pass every response to response_received(), which yields
+    the responses now due in offset order. Once `finished`, the end of
+    the file has been delivered; receive the answers to the requests
+    still in_flight and pass them to discard().
+    """
+
+    def __init__(self, transport, file_offset, byte_count=MAX_READ, depth=1):
+        self.transport = transport
+        self.depth = depth
+        self.in_flight = {}  # Sequence number -> (offset, byte count, time sent)
+        self.finished = False
+        self._arrived = {}  # Offset -> response or exception, received out of order
+        self._request_offset = file_offset
+        self._deliver_offset = file_offset
+        self._byte_count = byte_count
+        self._request = ReadRequest()
+        # Requests sent before the writer refused a read, answered before reading on.
+        self._stale = set()
+        self._shrink_to = None
+
+    def next_request(self):
+        """Return the next request to send, or None while the window is full"""
+        # Responses waiting for an earlier one count against the window too.
+        if (self.finished or self._stale or
+                len(self.in_flight) + len(self._arrived) >= self.depth):
+            return None
+        transport = self.transport
+        offset, byte_count = self._request_offset, self._byte_count
+        request = self._request.prepare(offset, byte_count)
+        request.sequence_number = transport.next_sequence_number()
+        self.in_flight[request.sequence_number] = (offset, byte_count, perf_counter())
+        self._request_offset = offset + byte_count
+        self._byte_count = min(byte_count * 2, transport.max_read)
+        return request
+
+    def discard(self, response):
+        """Forget the request response answers, without delivering it"""
+        self.in_flight.pop(response.sequence_number, None)
+
+    def _shrink(self):
+        transport = self.transport
+        transport.set_max_read(self._shrink_to)
+        self._shrink_to = None
+        self._request_offset = self._deliver_offset
+        self._byte_count = transport.max_read
+
+    def response_received(self, response):
+        """Yield the responses due now that response is in, in offset order
+
+        Raises the exception for an error response when its turn comes.
+        Each response is only valid until the next one is received.
+        """
+        sequence_number = response.sequence_number
+        if sequence_number in self._stale:
+            self._stale.discard(sequence_number)
+            del self.in_flight[sequence_number]
+            if not self._stale:
+                self._shrink()
+            return
+        offset, count, sent_at = self.in_flight.pop(sequence_number, (None, None, None))
+        if offset is None or not (
+                response.packet_type == PacketType.READ_FILE or response.is_error):
+            raise ProtocolViolationException()
+        transport = self.transport
+        transport._record_response(response, perf_counter() - sent_at)
+        try:
+            transport.handle_response(response)
+        except (UnableToPerformRequestException, FileNotAvailableException,
+                NoRealtimeFileException, FinishedReadingClosedFileException) as e:
+            response = (e, count)
+        else:
+            if offset != self._deliver_offset:
+                # The receive buffer is about to be reused.
+                response.data = bytes(response.data)
+            response = (response, count)
+        if offset != self._deliver_offset:
+            self._arrived[offset] = response
+            return
+
+        while response is not None:
+            response, count = response
+            if isinstance(response, UnableToPerformRequestException) and count > MAX_READ:
+                # Too big for this writer, try again with smaller reads once
+                # the reads already sent are answered.
+                self._arrived.clear()
+                self._stale.update(self.in_flight)
+                self._shrink_to = max(MAX_READ, count // 2)
+                if not self._stale:
+                    self._shrink()
+                return
+            if isinstance(response, Exception):
+                raise response
+            yield response
+            if response.data_length < count:
+                self.finished = True
+                return
+            self._deliver_offset += count
+            response = self._arrived.pop(self._deliver_offset, None)
+
+
+class MachineTransport(TransportBase):
+    """Simple interface to connect with and send data to a Stenograph machine"""
+
+    def connect(self):
+        """Connect to machine, raise an exception if an error occurred"""
+        raise NotImplementedError('connect() is not implemented')
+
+    def disconnect(self):
+        """Disconnect from the machine"""
+        raise NotImplementedError('disconnect() is not implemented')
+
+    def wait_for_device(self, stop, timeout):
+        """Wait until connect() is worth trying again, or stop is set.
+
+        Waits out timeout by default, so callers poll connect(); transports
+        that are told when a writer appears return as soon as it does.
+        """
+        stop.wait(timeout)
+
+    def send(self, request):
+        """Send a StenoPacket to the machine without waiting for the response"""
+        raise NotImplementedError('send() is not implemented')
+
+    def receive(self):
+        """Return the next packet from the machine, without checking it.
+
+        The packet may be a view over a receive buffer, valid only until
+        the next call.
+        """
+        raise NotImplementedError('receive() is not implemented')
+
+    def _send(self, request):
+        recorder = self.recorder
+        if recorder is None:
+            return self.send(request)
+        try:
+            self.send(request)
+        except ConnectionError:
+            recorder.disconnect()
+            raise
+        recorder.request(request)
+
+    def _receive(self):
+        recorder = self.recorder
+        if recorder is None:
+            return self.receive()
+        try:
+            response = self.receive()
+        except ConnectionError:
+            recorder.disconnect()
+            raise
+        recorder.response(response)
+        return response
+
+    def send_receive(self, request):
+        """Send a StenoPacket to the machine and return the response"""
+        request.sequence_number = self.next_sequence_number()
+        sent_at = perf_counter()
+        self._send(request)
+        response = self._receive()
+        self._record_response(response, perf_counter() - sent_at)
+        return self.check_response(request, response)
+
+    def read_pipelined(self, file_offset, byte_count=MAX_READ, depth=None):
+        """Read the open file from file_offset on, with several requests in flight
+
+        Keeps up to depth (default pipeline_depth) READ_FILE requests out
+        for consecutive offsets. Responses are matched to their request by
+        sequence number and yielded in offset order. Stops after the first
+        response shorter than its request, which is the current end of the
+        file. Each response is only valid until the generator is resumed.
+
+        The byte_count of each request doubles from byte_count up to
+        max_read. If the writer refuses a read larger than MAX_READ,
+        max_read is halved and reading carries on from there.
+        """
+        pipeline = ReadPipeline(self, file_offset, byte_count,
+                                self.pipeline_depth if depth is None else depth)
+        # Once out of step with the writer, there is no point waiting for the rest.
+        drain = True
+        try:
+            while not pipeline.finished:
+                request = pipeline.next_request()
+                while request is not None:
+                    self._send(request)
+                    request = pipeline.next_request()
+                yield from pipeline.response_received(self._receive())
+        except (ConnectionError, ProtocolViolationException):
+            drain = False
+            raise
+        finally:
+            if drain:
+                # Keep the stream in step with our requests.
+                while pipeline.in_flight:
+                    pipeline.discard(self._receive())
@@ -0,0 +1,309 @@
+from time import monotonic, perf_counter
+import asyncio
+import socket
+
+from stenograph.transport import ReadPipeline, TransportBase
+from stenograph.packet import MAX_READ
+from stenograph.reader import RealtimeReader
+from stenograph.exception import (
+    ConnectionError, ProtocolViolationException,
+    NoRealtimeFileException, FinishedReadingClosedFileException,
+)
+from stenograph.discovery import (
+    BATTLE_CRY, BROADCAST_ADDRESS, BROADCAST_PORT, DISCOVERY_TIMEOUT, DISCOVERY_WINDOW,
+    DiscoveryRound, discovery_targets,
+)
+from stenograph.transport_wifi import (
+    WiFiConnection, WiFiTransport, WRITER_PORT, CONNECT_TIMEOUT, configure_socket,
+)
+
+
+RECONNECT_INTERVAL = 0.25
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Passes the answers to the discovery handshake on to a DiscoveryRound"""
+
+    def __init__(self, discovery):
+        self.discovery = discovery
+
+    def datagram_received(self, data, address):
+        self.discovery.datagram_received(data, address, monotonic())
+
+    def error_received(self, exc):
+        # An ICMP error for one of the probed hosts, the others may still answer.
+        pass
+
+
+async def discover_writers(discovery_address=BROADCAST_ADDRESS, discovery_port=BROADCAST_PORT,
+                           subnets=(), window=DISCOVERY_WINDOW):
+    """asyncio counterpart of stenograph.discovery.discover_writers()"""
+    loop = asyncio.get_running_loop()
+    discovery = DiscoveryRound()
+    endpoints = []
+    try:
+        for address, destinations in discovery_targets(discovery_address, subnets).items():
+            try:
+                transport, _protocol = await loop.create_datagram_endpoint(
+                    lambda: DiscoveryProtocol(discovery), local_addr=(address or '0.0.0.0', 0),
+                    family=socket.AF_INET, allow_broadcast=True,
+                )
+            except OSError:
+                # The interface went away since we listed it.
+                continue
+            endpoints.append((transport, destinations))
+        if not endpoints:
+            raise ConnectionError("No network interface to discover writers on")
+
+        discovery.sent_at = monotonic()
+        for transport, destinations in endpoints:
+            for destination in destinations:
+                transport.sendto(BATTLE_CRY, (destination, discovery_port))
+        await asyncio.sleep(window)
+        return discovery.writers
+    finally:
+        for transport, _destinations in endpoints:
+            transport.close()
+
+
+class AsyncWiFiTransport(TransportBase):
+    """
+    WiFiTransport for asyncio, where connect(), disconnect(), send(),
+    receive() and send_receive() are coroutines and read_pipelined() is an
+    asynchronous generator
+    """
+
+    PIPELINE_DEPTH = WiFiTransport.PIPELINE_DEPTH
+    MAX_READ_LIMIT = WiFiTransport.MAX_READ_LIMIT
+    MIN_TIMEOUT = WiFiTransport.MIN_TIMEOUT
+    MAX_TIMEOUT = WiFiTransport.MAX_TIMEOUT
+
+    def __init__(self, address_cache=None, pipeline_depth=PIPELINE_DEPTH, max_read=None,
+                 address=None, port=WRITER_PORT,
+                 discovery_address=BROADCAST_ADDRESS, discovery_port=BROADCAST_PORT, subnets=()):
+        """Takes the same arguments as WiFiTransport"""
+        super().__init__(pipeline_depth=pipeline_depth, max_read=max_read)
+        self.connection = WiFiConnection(address_cache, self.max_read, address, port,
+                                         discovery_address, discovery_port, subnets)
+        self._sock = None
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def set_max_read(self, max_read):
+        super().set_max_read(max_read)
+        self.connection.set_max_read(self.max_read)
+
+    async def discover(self):
+        """Return every writer answering one round of discovery, fastest first"""
+        connection = self.connection
+        return await discover_writers(connection.discovery_address, connection.discovery_port,
+                                      connection.subnets)
+
+    async def find_stenograph(self, timeout=DISCOVERY_TIMEOUT):
+        """Return the host of the fastest writer not used by another transport"""
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            host = self.connection.choose_writer(await self.discover())
+            if host is not None:
+                return host
+        raise ConnectionError("Client timed out")
+
+    async def _connect_socket(self, host):
+        loop = asyncio.get_running_loop()
+        family, type_, proto, _name, address = (await loop.getaddrinfo(
+            host, self.connection.port, type=socket.SOCK_STREAM))[0]
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, address)
+            configure_socket(sock, self.rtt_estimator.max_timeout)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _open_socket(self, host, timeout):
+        """Claim the writer at host and connect to it"""
+        self.connection.claim(host)
+        try:
+            return await asyncio.wait_for(self._connect_socket(host), timeout)
+        except asyncio.TimeoutError as e:
+            self.connection.release()
+            raise ConnectionError("Stenograph writer timed out: %s" % e)
+        except OSError as e:
+            self.connection.release()
+            raise ConnectionError("Stenograph writer binding error: %s" % e)
+        except BaseException:
+            self.connection.release()
+            raise
+
+    async def connect(self):
+        """Attempt to connect, trying the last writer we found before broadcasting"""
+        if self.connected:
+            await self.disconnect()
+
+        connection = self.connection
+        sock = None
+        known_host = connection.known_host()
+        if known_host:
+            try:
+                sock = await self._open_socket(*known_host)
+            except ConnectionError:
+                if not connection.can_discover:
+                    raise
+
+        discovered = sock is None
+        if discovered:
+            sock = await self._open_socket(await self.find_stenograph(), CONNECT_TIMEOUT)
+        connection.connected(discovered)
+        self._sock = sock
+
+    async def disconnect(self):
+        sock = self._sock
+        self._sock = None
+        self.connection.disconnected()
+        if sock is not None:
+            sock.close()
+
+    async def _read_packet(self):
+        loop = asyncio.get_running_loop()
+        connection = self.connection
+        packet = None
+        while packet is None:
+            received = await loop.sock_recv_into(self._sock, connection.receive_buffer())
+            if not received:
+                raise ConnectionError("No response from writer")
+            connection.received(received)
+            packet = connection.next_packet()
+        return packet
+
+    async def send(self, request):
+        assert self.connected, "Cannot write to machine if not connected."
+        try:
+            await asyncio.get_running_loop().sock_sendall(self._sock, request.pack())
+        except Exception as e:
+            self.connection.request_failed()
+            raise ConnectionError(e)
+
+    async def receive(self):
+        """Return the next packet from the writer, a view valid until the next call"""
+        assert self.connected, "Cannot read from machine if not connected."
+        # timed_out() lengthens the timeout, report the one that ran out.
+        timeout = self.timeout
+        try:
+            packet = self.connection.next_packet()
+            if packet is None:
+                packet = await asyncio.wait_for(self._read_packet(), timeout)
+            return packet
+        except ConnectionError:
+            self.connection.request_failed()
+            raise
+        except asyncio.TimeoutError:
+            self.connection.request_failed()
+            self.rtt_estimator.timed_out()
+            raise ConnectionError("No response from writer in %.2fs" % timeout)
+        except Exception as e:
+            self.connection.request_failed()
+            raise ConnectionError(e)
+
+    async def _send(self, request):
+        recorder = self.recorder
+        try:
+            await self.send(request)
+        except ConnectionError:
+            if recorder is not None:
+                recorder.disconnect()
+            raise
+        if recorder is not None:
+            recorder.request(request)
+
+    async def _receive(self):
+        recorder = self.recorder
+        try:
+            response = await self.receive()
+        except ConnectionError:
+            if recorder is not None:
+                recorder.disconnect()
+            raise
+        if recorder is not None:
+            recorder.response(response)
+        return response
+
+    async def send_receive(self, request):
+        """Send a StenoPacket to the writer and return the response"""
+        request.sequence_number = self.next_sequence_number()
+        sent_at = perf_counter()
+        await self._send(request)
+        response = await self._receive()
+        self._record_response(response, perf_counter() - sent_at)
+        return self.check_response(request, response)
+
+    async def read_pipelined(self, file_offset, byte_count=MAX_READ, depth=None):
+        """asyncio counterpart of MachineTransport.read_pipelined()"""
+        pipeline = ReadPipeline(self, file_offset, byte_count,
+                                self.pipeline_depth if depth is None else depth)
+        # Once out of step with the writer, there is no point waiting for the rest.
+        drain = True
+        try:
+            while not pipeline.finished:
+                request = pipeline.next_request()
+                while request is not None:
+                    await self._send(request)
+                    request = pipeline.next_request()
+                for response in pipeline.response_received(await self._receive()):
+                    yield response
+        except (ConnectionError, ProtocolViolationException):
+            drain = False
+            raise
+        finally:
+            if drain:
+                # Keep the stream in step with our requests.
+                while pipeline.in_flight:
+                    pipeline.discard(await self._receive())
+
+
+async def read_realtime_strokes(transport, reader=None):
+    """Yield strokes from the writer's realtime file as they are written
+
+    Connects the transport if needed and reconnects whenever the connection
+    drops. This is the asyncio counterpart of StenographMachine.run(), and
+    drives the same RealtimeReader.
+    """
+    if reader is None:
+        reader = RealtimeReader()
+    stats = transport.stats
+    disconnected = False
+    while True:
+        try:
+            if not transport.connected:
+                await transport.connect()
+                if disconnected:
+                    stats.record_reconnect(monotonic())
+                    disconnected = False
+            if reader.catching_up:
+                # Nothing is delivered until we catch up, so read ahead.
+                strokes = []
+                async for response in transport.read_pipelined(reader.offset):
+                    strokes.extend(reader.handle_response(response))
+            else:
+                response = await transport.send_receive(reader.next_request())
+                strokes = reader.handle_response(response)
+        except ConnectionError as e:
+            stats.record_exception(e)
+            stats.record_disconnect(monotonic())
+            disconnected = True
+            reader.disconnected()
+            await transport.disconnect()
+            await asyncio.sleep(RECONNECT_INTERVAL)
+            continue
+        except (NoRealtimeFileException, FinishedReadingClosedFileException) as e:
+            stats.record_exception(e)
+            reader.reset()
+            continue
+        stats.strokes_read += len(strokes)
+        for stroke in strokes:
+            yield stroke
+        if reader.delay:
+            await asyncio.sleep(reader.delay)
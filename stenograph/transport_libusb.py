@@ -1,23 +1,104 @@
+from threading import Lock
+from time import monotonic
+import errno
+
 from usb import core, util
-from pyusb_libusb1_backend import get_pyusb_backend
 
+from stenograph.hotplug_libusb import HotplugMonitor
 from stenograph.transport import MachineTransport
-from stenograph.packet import MAX_READ, StenoPacket
-from stenograph.exception import ProtocolViolationException, ConnectionError
+from stenograph.packet import StenoPacket
+from stenograph.exception import ConnectionError
 
 
 VENDOR_ID = 0x112b
 
+# (bus, address) of the writers held by a transport in this process.
+_claimed_devices = set()
+_claimed_devices_lock = Lock()
+
+# (idVendor, idProduct, bcdDevice) -> (OUT, IN) endpoint addresses, so
+# reconnecting to a known model skips walking its descriptors.
+_endpoint_cache = {}
+
+# Look for writers now and then even with hotplug, in case an arrival is missed.
+HOTPLUG_RESCAN_INTERVAL = 5.0
+
 
 class LibusbTransport(MachineTransport):
 
-    def __init__(self):
-        super().__init__()
+    MAX_READ_LIMIT = 0x1000
+
+    def __init__(self, max_read=None, bus=None, address=None, serial_number=None, backend=None):
+        """max_read -- largest READ_FILE byte_count to ask the writer for
+
+        bus, address, serial_number -- only connect to a writer matching
+        these, any writer not already in use if None
+
+        backend -- pyusb backend to find the writer with, defaults to
+        libusb1, which is only loaded once it is needed
+        """
+        super().__init__(max_read=max_read)
+        self.bus = bus
+        self.address = address
+        self.serial_number = serial_number
+        self._device_key = None
         self._usb_device = None
         self._endpoint_in = None
         self._endpoint_out = None
         self._connected = False
-        self._backend = get_pyusb_backend()
+        self._backend = backend
+        self._hotplug = None
+        self._hotplug_available = True
+        self._allocate_read_buffer()
+
+    def _allocate_read_buffer(self):
+        # pyusb only reads into an array, not a bytearray.
+        self._read_buffer = util.create_buffer(self.max_read + StenoPacket.HEADER_SIZE)
+        self._read_view = memoryview(self._read_buffer)
+
+    def set_max_read(self, max_read):
+        super().set_max_read(max_read)
+        self._allocate_read_buffer()
+
+    def _get_backend(self):
+        if self._backend is None:
+            from usb.backend import libusb1
+            from pyusb_libusb1_backend import get_pyusb_backend
+            self._backend = get_pyusb_backend() or libusb1.get_backend()
+        return self._backend
+
+    def _matches(self, usb_device):
+        if self.bus is not None and usb_device.bus != self.bus:
+            return False
+        if self.address is not None and usb_device.address != self.address:
+            return False
+        if self.serial_number is not None:
+            try:
+                serial_number = util.get_string(usb_device, usb_device.iSerialNumber)
+            except (ValueError, core.USBError):
+                # No serial number, or the device can't be opened to read it.
+                return False
+            if serial_number != self.serial_number:
+                return False
+        return True
+
+    def _claim_device(self):
+        """Find a matching writer no other transport is using, and mark it as ours"""
+        with _claimed_devices_lock:
+            for usb_device in core.find(find_all=True, backend=self._get_backend(),
+                                        idVendor=VENDOR_ID, custom_match=self._matches):
+                device_key = (usb_device.bus, usb_device.address)
+                if device_key not in _claimed_devices:
+                    _claimed_devices.add(device_key)
+                    self._device_key = device_key
+                    return usb_device
+        return None
+
+    def _release_device(self):
+        if self._device_key is not None:
+            with _claimed_devices_lock:
+                _claimed_devices.discard(self._device_key)
+            self._device_key = None
 
     def connect(self):
         """Attempt to and return connection"""
@@ -25,13 +106,62 @@ class LibusbTransport(MachineTransport):
         if self._connected:
             self.disconnect()
 
-        # Find the device by the vendor ID.
-        usb_device = core.find(backend=self._backend, idVendor=VENDOR_ID)
+        usb_device = self._claim_device()
         if not usb_device:  # Device not found
             raise ConnectionError("USB device not connected")
+        try:
+            self._open_device(usb_device)
+        except Exception:
+            self._release_device()
+            raise
 
+    def wait_for_device(self, stop, timeout):
+        """Wait for a writer to be plugged in, if libusb can tell us, or timeout otherwise"""
+        if self._connected:
+            self.disconnect()
+        monitor = self._start_hotplug()
+        if monitor is None:
+            return super().wait_for_device(stop, timeout)
+        deadline = monotonic() + HOTPLUG_RESCAN_INTERVAL
+        while not stop.is_set() and not monitor.arrived.is_set():
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            monitor.arrived.wait(min(timeout, remaining))
+        monitor.arrived.clear()
+
+    def _start_hotplug(self):
+        if self._hotplug is None and self._hotplug_available:
+            monitor = HotplugMonitor.create(self._get_backend(), VENDOR_ID)
+            if monitor is not None and monitor.start():
+                self._hotplug = monitor
+            else:
+                self._hotplug_available = False
+        return self._hotplug
+
+    def _stop_hotplug(self):
+        if self._hotplug is not None:
+            self._hotplug.stop()
+            self._hotplug = None
+
+    def _open_device(self, usb_device):
         # Copy the default configuration.
         usb_device.set_configuration()
+
+        model = (usb_device.idVendor, usb_device.idProduct, usb_device.bcdDevice)
+        endpoints = _endpoint_cache.get(model)
+        if endpoints is None:
+            endpoints = self._find_endpoints(usb_device)
+            _endpoint_cache[model] = endpoints
+
+        self._usb_device = usb_device
+        self._endpoint_out, self._endpoint_in = endpoints
+        self._connected = True
+        self._stop_hotplug()
+
+    @staticmethod
+    def _find_endpoints(usb_device):
+        """Return the addresses of the OUT and IN endpoints of usb_device"""
         config = usb_device.get_active_configuration()
         interface = config[(0, 0)]
 
@@ -53,10 +183,7 @@ class LibusbTransport(MachineTransport):
         )
         assert endpoint_in is not None, 'cannot find read endpoint'
 
-        self._usb_device = usb_device
-        self._endpoint_in = endpoint_in
-        self._endpoint_out = endpoint_out
-        self._connected = True
+        return endpoint_out.bEndpointAddress, endpoint_in.bEndpointAddress
 
     def disconnect(self):
         self._connected = False
@@ -65,20 +192,32 @@ class LibusbTransport(MachineTransport):
         self._usb_device = None
         self._endpoint_in = None
         self._endpoint_out = None
+        self._release_device()
+        self._stop_hotplug()
+
+    def _timeout_ms(self):
+        # libusb takes 0 to mean no timeout at all.
+        return max(1, int(self.rtt_estimator.timeout * 1000))
+
+    def _connection_error(self, e):
+        if isinstance(e, core.USBError) and e.errno == errno.ETIMEDOUT:
+            self.rtt_estimator.timed_out()
+        return ConnectionError(e)
+
+    def send(self, request):
+        assert self._connected, 'cannot write to machine if not connected'
+        try:
+            self._usb_device.write(self._endpoint_out, request.pack(), self._timeout_ms())
+        except Exception as e:
+            raise self._connection_error(e)
 
-    def send_receive(self, request):
+    def receive(self):
         assert self._connected, 'cannot read from machine if not connected'
         try:
-            self._endpoint_out.write(request.pack())
-            response = self._endpoint_in.read(
-                MAX_READ + StenoPacket.HEADER_SIZE, 3000)
+            response_length = self._usb_device.read(
+                self._endpoint_in, self._read_buffer, self._timeout_ms())
         except Exception as e:
-            raise ConnectionError(e)
-        else:
-            if response and len(response) >= StenoPacket.HEADER_SIZE:
-                writer_packet = StenoPacket.unpack(response)
-                if (writer_packet.sequence_number == request.sequence_number and
-                    writer_packet.packet_type == request.packet_type):
-                    return self.handle_response(writer_packet)
-                raise ProtocolViolationException()
+            raise self._connection_error(e)
+        if response_length < StenoPacket.HEADER_SIZE:
             raise ConnectionError("No response from writer")
+        return StenoPacket.unpack(self._read_view[:response_length])
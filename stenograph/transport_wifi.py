@@ -1,73 +1,328 @@
-from threading import Event
+from threading import Lock
+from time import monotonic
 import socket
 
 from stenograph.transport import MachineTransport
 from stenograph.packet import MAX_READ, StenoPacket
+from stenograph.discovery import (
+    BROADCAST_ADDRESS, BROADCAST_PORT, DISCOVERY_TIMEOUT, discover_writers,
+)
+# Unused here, kept so imports from before discovery moved out still work.
+from stenograph.discovery import BATTLE_CRY, MACHINE_RESPONSE  # noqa: F401
 from stenograph.exception import ProtocolViolationException, ConnectionError
 
 
-# For UDP broadcast. Stenograph machines listen on port 5012 for opening packet.
-# Response is sent on port 5015.
-BROADCAST_ADDRESS = "255.255.255.255"
-BROADCAST_PORT = 5012
+# Stenograph machines accept the data connection on port 80.
+WRITER_PORT = 80
+CONNECT_TIMEOUT = 10
+# A writer we found before should answer quickly, if it's still there.
+DIRECT_CONNECT_TIMEOUT = 1
 
-# This is the specific reply by Stenograph machines to indicate their presence.
-BATTLE_CRY = b"Calling All Miras...\x00\x00\x00\x00\x00\x00\x00\x00"
-MACHINE_RESPONSE = b"Mira in the neighborhood "
+# Probe an idle connection after this many seconds, then every
+# KEEPALIVE_INTERVAL, dropping it after KEEPALIVE_PROBES go unanswered.
+KEEPALIVE_IDLE = 1
+KEEPALIVE_INTERVAL = 1
+KEEPALIVE_PROBES = 3
 
+# (host, port) of the writers held by a transport in this process.
+_claimed_hosts = set()
+_claimed_hosts_lock = Lock()
 
-class WiFiTransport(MachineTransport):
 
-    def __init__(self):
-        super().__init__()
-        self._connected = False
-        self._sock = None
-        self._stenograph_address = None
+def load_cached_host(path):
+    """Return the writer host remembered in the file at path, if any"""
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
 
-    def find_stenograph(self):
+
+def _set_option(sock, level, name, value):
+    """Set a socket option the OS may not support, returning whether it took"""
+    option = getattr(socket, name, None)
+    if option is None:
+        return False
+    try:
+        sock.setsockopt(level, option, value)
+    except OSError:
+        return False
+    return True
+
+
+def configure_socket(sock, user_timeout):
+    """Send requests as soon as they are written, and notice a dead writer quickly
+
+    user_timeout -- seconds sent data may go unacknowledged before the
+    connection is dropped, where the OS supports it
+
+    Every option is only a speed-up, so any the OS refuses is skipped.
+    """
+    _set_option(sock, socket.IPPROTO_TCP, 'TCP_NODELAY', 1)
+    _set_option(sock, socket.SOL_SOCKET, 'SO_KEEPALIVE', 1)
+    # TCP_KEEPALIVE is the macOS name. Windows builds always define
+    # TCP_KEEPIDLE, but Windows before 10 1709 refuses it.
+    if not (_set_option(sock, socket.IPPROTO_TCP, 'TCP_KEEPIDLE', KEEPALIVE_IDLE) or
+            _set_option(sock, socket.IPPROTO_TCP, 'TCP_KEEPALIVE', KEEPALIVE_IDLE)):
+        if hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+            # Older Windows, in milliseconds.
+            try:
+                sock.ioctl(socket.SIO_KEEPALIVE_VALS,
+                           (1, KEEPALIVE_IDLE * 1000, KEEPALIVE_INTERVAL * 1000))
+            except OSError:
+                pass
+    _set_option(sock, socket.IPPROTO_TCP, 'TCP_KEEPINTVL', KEEPALIVE_INTERVAL)
+    _set_option(sock, socket.IPPROTO_TCP, 'TCP_KEEPCNT', KEEPALIVE_PROBES)
+    _set_option(sock, socket.IPPROTO_TCP, 'TCP_USER_TIMEOUT', int(user_timeout * 1000))
+
+
+def save_cached_host(path, host):
+    if not path:
+        return
+    try:
+        with open(path, 'w') as f:
+            f.write(host)
+    except OSError:
+        # Only an optimization, discovery still works without it.
+        pass
+
+
+class WiFiConnection:
+    """
+    The part of a Wi-Fi writer connection that does no I/O, which
+    WiFiTransport and AsyncWiFiTransport are built on
+
+    Decides which writer to connect to: the fixed address if there is one,
+    otherwise the writer found last time, otherwise the fastest writer
+    discovery finds that no other transport in this process has claimed.
+    A remembered writer that fails its first request is forgotten, so the
+    next attempt discovers again. Also splits the bytes received back into
+    packets.
+    """
+
+    def __init__(self, address_cache=None, max_read=MAX_READ, address=None, port=WRITER_PORT,
+                 discovery_address=BROADCAST_ADDRESS, discovery_port=BROADCAST_PORT, subnets=()):
+        self.address = address
+        self.port = port
+        self.discovery_address = discovery_address
+        self.discovery_port = discovery_port
+        self.subnets = subnets
+        # (host, port) of the writer this connection holds.
+        self.claimed = None
+        # Host of the last writer we connected to, kept across disconnects.
+        self._address_cache = address_cache
+        self.last_host = load_cached_host(address_cache)
+        # Set while connected to last_host but it hasn't answered a request yet.
+        self._last_host_unconfirmed = False
+        self._read_buffer = bytearray(max_read + StenoPacket.HEADER_SIZE)
+        self._read_view = memoryview(self._read_buffer)
+        # Bytes received but not yet returned are _read_buffer[_read_start:_read_end].
+        self._read_start = 0
+        self._read_end = 0
+
+    def known_host(self):
+        """Return (host, connect timeout) of the writer to try before discovery, or None"""
+        if self.address:
+            # A fixed writer, never discovered or cached.
+            return (self.address, CONNECT_TIMEOUT)
+        if self.last_host:
+            return (self.last_host, DIRECT_CONNECT_TIMEOUT)
+        return None
+
+    @property
+    def can_discover(self):
+        return not self.address
+
+    def choose_writer(self, writers):
+        """Return the host of the fastest of writers not used by another transport, or None"""
+        for writer in writers:
+            if (writer.host, self.port) not in _claimed_hosts:
+                return writer.host
+        return None
+
+    def claim(self, host):
+        """Reserve the writer at host before connecting to it"""
+        address = (host, self.port)
+        with _claimed_hosts_lock:
+            if address in _claimed_hosts:
+                raise ConnectionError("Stenograph writer %s:%u is already in use" % address)
+            _claimed_hosts.add(address)
+        self.claimed = address
+
+    def release(self):
+        if self.claimed is not None:
+            with _claimed_hosts_lock:
+                _claimed_hosts.discard(self.claimed)
+            self.claimed = None
+
+    def connected(self, discovered):
+        """Note that the claimed writer is connected
+
+        discovered -- whether discovery found it, rather than it being the
+        fixed or remembered one
+        """
+        host = self.claimed[0]
+        self._read_start = self._read_end = 0
+        if discovered:
+            if host != self.last_host:
+                self.last_host = host
+                save_cached_host(self._address_cache, host)
+        elif not self.address:
+            # Something else may have the address now, wait for it to answer.
+            self._last_host_unconfirmed = True
+
+    def disconnected(self):
+        self._last_host_unconfirmed = False
+        self._read_start = self._read_end = 0
+        self.release()
+
+    def request_failed(self):
+        """Forget the remembered writer if it never answered"""
+        if self._last_host_unconfirmed:
+            self._last_host_unconfirmed = False
+            self.last_host = None
+            save_cached_host(self._address_cache, '')
+
+    def set_max_read(self, max_read):
+        pending = self._read_buffer[self._read_start:self._read_end]
+        self._read_buffer = bytearray(max(max_read + StenoPacket.HEADER_SIZE, len(pending)))
+        self._read_buffer[:len(pending)] = pending
+        self._read_view = memoryview(self._read_buffer)
+        self._read_start, self._read_end = 0, len(pending)
+
+    def next_packet(self):
+        """Return the next whole packet received, or None until more is received.
+
+        The returned packet is a view over the receive buffer and is only
+        valid until the next call.
+        """
+        start, end = self._read_start, self._read_end
+        if start == end:
+            self._read_start = self._read_end = 0
+            return None
+        if start:
+            # Move a partial packet left over from the last read to the front.
+            end -= start
+            self._read_buffer[:end] = self._read_buffer[start:start + end]
+            self._read_start, self._read_end = 0, end
+        if end < StenoPacket.HEADER_SIZE:
+            return None
         try:
-            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-            udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            udp.settimeout(10)
+            packet_size = StenoPacket.HEADER_SIZE + StenoPacket.peek_data_length(self._read_view)
+            if packet_size > len(self._read_buffer):
+                raise ProtocolViolationException("Packet of %u bytes does not fit in buffer" % packet_size)
+        except ProtocolViolationException as e:
+            # There's no finding the next packet in a TCP stream, so start over.
+            self._read_start = self._read_end = 0
+            raise ConnectionError("Lost packet framing: %s" % e)
+        if end < packet_size:
+            return None
+        self._read_start = packet_size
+        self._last_host_unconfirmed = False
+        return StenoPacket.unpack(self._read_view[:packet_size])
 
-            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def receive_buffer(self):
+        """Return the free space to receive into, once next_packet() has returned None"""
+        return self._read_view[self._read_end:]
 
-            found_machine = Event()
+    def received(self, length):
+        """Note that length bytes were received into receive_buffer()"""
+        self._read_end += length
 
-            while not found_machine.wait(1.2):
-                udp.sendto(BATTLE_CRY, (BROADCAST_ADDRESS, BROADCAST_PORT))
-                data, address = udp.recvfrom(65565)
-                if MACHINE_RESPONSE in data:
-                    self._stenograph_address = address
-                    udp.close()
-                    found_machine.set()
 
-        except socket.timeout as e:
-            raise ConnectionError("Client timed out: %s" % e)
-        
-        return self._stenograph_address
+class WiFiTransport(MachineTransport):
 
-    def connect(self):
-        """Attempt to connect and return connection"""
-        if self._connected:
-            self.disconnect()
+    PIPELINE_DEPTH = 4
+    MAX_READ_LIMIT = 0x2000
+    # Wi-Fi power saving can hold a response back for a few hundred milliseconds.
+    MIN_TIMEOUT = 0.5
+    MAX_TIMEOUT = 5.0
+
+    def __init__(self, address_cache=None, pipeline_depth=PIPELINE_DEPTH, max_read=None,
+                 address=None, port=WRITER_PORT,
+                 discovery_address=BROADCAST_ADDRESS, discovery_port=BROADCAST_PORT, subnets=()):
+        """address_cache -- optional path of a file to remember the last writer address in
 
-        self._stenograph_address = self.find_stenograph()
+        pipeline_depth -- how many READ_FILE requests to keep in flight when reading ahead
 
-        # No IP address = no device found.
-        if not self._stenograph_address:
-            raise ConnectionError("Could not find Stenograph writer")
+        max_read -- largest READ_FILE byte_count to ask the writer for
 
+        address -- host of the writer to connect to, skipping discovery
+
+        port -- TCP port writers accept the data connection on
+
+        discovery_address, discovery_port -- where to send the discovery handshake
+
+        subnets -- subnets like '192.168.1.0/24' to also probe host by host
+        """
+        super().__init__(pipeline_depth=pipeline_depth, max_read=max_read)
+        self.connection = WiFiConnection(address_cache, self.max_read, address, port,
+                                         discovery_address, discovery_port, subnets)
+        self._connected = False
+        self._sock = None
+        self._sock_timeout = None
+
+    def set_max_read(self, max_read):
+        super().set_max_read(max_read)
+        self.connection.set_max_read(self.max_read)
+
+    def discover(self):
+        """Return every writer answering one round of discovery, fastest first"""
+        connection = self.connection
+        return discover_writers(connection.discovery_address, connection.discovery_port,
+                                connection.subnets)
+
+    def find_stenograph(self):
+        """Return the host of the fastest writer not used by another transport"""
+        deadline = monotonic() + DISCOVERY_TIMEOUT
+        while monotonic() < deadline:
+            host = self.connection.choose_writer(self.discover())
+            if host is not None:
+                return host
+        raise ConnectionError("Client timed out")
+
+    def _open_socket(self, host, timeout):
+        """Claim the writer at host and connect to it"""
+        self.connection.claim(host)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)
-            sock.connect((self._stenograph_address[0], 80))
-            self._sock = sock
+            sock = socket.create_connection((host, self.connection.port), timeout)
         except socket.timeout as e:
+            self.connection.release()
             raise ConnectionError("Stenograph writer timed out: %s" % e)
         except socket.error as e:
+            self.connection.release()
             raise ConnectionError("Stenograph writer binding error: %s" % e)
+        try:
+            configure_socket(sock, self.rtt_estimator.max_timeout)
+        except BaseException:
+            sock.close()
+            self.connection.release()
+            raise
+        self._sock_timeout = None
+        return sock
 
+    def connect(self):
+        """Attempt to connect and return connection"""
+        if self._connected:
+            self.disconnect()
+
+        connection = self.connection
+        sock = None
+        known_host = connection.known_host()
+        if known_host:
+            try:
+                sock = self._open_socket(*known_host)
+            except ConnectionError:
+                if not connection.can_discover:
+                    raise
+
+        discovered = sock is None
+        if discovered:
+            sock = self._open_socket(self.find_stenograph(), CONNECT_TIMEOUT)
+        connection.connected(discovered)
+        self._sock = sock
         self._connected = True
 
     def disconnect(self):
@@ -75,23 +330,52 @@ class WiFiTransport(MachineTransport):
             self._sock.close()
             self._sock = None
         self._connected = False
-        self._stenograph_address = None
+        self.connection.disconnected()
 
-    def send_receive(self, request):
-        assert self._connected, "Cannot read from machine if not connected."
+    def _read_packet(self):
+        """Read exactly one packet, keeping any bytes after it for the next call.
+
+        The returned packet is a view over the receive buffer and is only
+        valid until the next call.
+        """
+        connection = self.connection
+        packet = connection.next_packet()
+        while packet is None:
+            # Ask for all the free space so a following packet arrives in the same call.
+            received = self._sock.recv_into(connection.receive_buffer())
+            if not received:
+                raise ConnectionError("No response from writer")
+            connection.received(received)
+            packet = connection.next_packet()
+        return packet
+
+    def _update_timeout(self):
+        timeout = self.rtt_estimator.timeout
+        if timeout != self._sock_timeout:
+            self._sock.settimeout(timeout)
+            self._sock_timeout = timeout
+
+    def send(self, request):
+        assert self._connected, "Cannot write to machine if not connected."
+        self._update_timeout()
         try:
-            self._sock.send(request.pack())
+            self._sock.sendall(request.pack())
+        except Exception as e:
+            self.connection.request_failed()
+            raise ConnectionError(e)
 
-            # Buffer size = MAX_READ + StenoPacket.HEADER_SIZE
-            response = self._sock.recv(MAX_READ + StenoPacket.HEADER_SIZE)
+    def receive(self):
+        assert self._connected, "Cannot read from machine if not connected."
+        self._update_timeout()
+        try:
+            return self._read_packet()
+        except ConnectionError:
+            self.connection.request_failed()
+            raise
+        except socket.timeout:
+            self.connection.request_failed()
+            self.rtt_estimator.timed_out()
+            raise ConnectionError("No response from writer in %.2fs" % self._sock_timeout)
         except Exception as e:
+            self.connection.request_failed()
             raise ConnectionError(e)
-        else:
-            if response and len(response) >= StenoPacket.HEADER_SIZE:
-                writer_packet = StenoPacket.unpack(response)
-                if (writer_packet.sequence_number == request.sequence_number and
-                    (writer_packet.packet_type == request.packet_type or
-                        writer_packet.is_error or writer_packet.is_ok)):
-                    return self.handle_response(writer_packet)
-                raise ProtocolViolationException()
-            raise ConnectionError("No response from writer")
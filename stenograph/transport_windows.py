@@ -1,10 +1,11 @@
 from ctypes import windll, wintypes
+from threading import Lock
 import ctypes
 import uuid
 
 from stenograph.transport import MachineTransport
-from stenograph.packet import MAX_READ, StenoPacket
-from stenograph.exception import ProtocolViolationException, ConnectionError, ConnectionError
+from stenograph.packet import StenoPacket
+from stenograph.exception import ConnectionError
 
 GUID = wintypes.BYTE * 16
 HDEVINFO = wintypes.HANDLE
@@ -128,26 +129,44 @@ GENERIC_WRITE = 0x40000000
 
 INVALID_HANDLE_VALUE = -1
 
+# Device paths of the writers opened by a transport in this process.
+_claimed_devices = set()
+_claimed_devices_lock = Lock()
+
 
 class WindowsUsbTransport(MachineTransport):
 
-    def __init__(self):
-        super().__init__()
+    MAX_READ_LIMIT = 0x1000
+
+    def __init__(self, max_read=None, device_index=0):
+        """max_read -- largest READ_FILE byte_count to ask the writer for
+
+        device_index -- which of the connected writers to open, in the order Windows
+        lists them; if another transport has it, the next free one after it
+        """
+        super().__init__(max_read=max_read)
+        self.device_index = device_index
         self._usb_device = INVALID_HANDLE_VALUE
-        self._read_buffer = ctypes.create_string_buffer(MAX_READ + StenoPacket.HEADER_SIZE)
+        self._device_path = None
+        self._read_buffer = ctypes.create_string_buffer(self.max_read + StenoPacket.HEADER_SIZE)
+
+    def set_max_read(self, max_read):
+        super().set_max_read(max_read)
+        self._read_buffer = ctypes.create_string_buffer(self.max_read + StenoPacket.HEADER_SIZE)
 
     @staticmethod
-    def _open_device_instance(device_info, guid):
+    def _device_instance_path(device_info, guid, index):
+        """Return the path of the index'th writer, or None past the last one"""
         dev_interface_data = SP_DEVICE_INTERFACE_DATA()
         dev_interface_data.cbSize = ctypes.sizeof(SP_DEVICE_INTERFACE_DATA)
 
         if not SetupDiEnumDeviceInterfaces(
             device_info, None, ctypes.byref(guid),
-            0, ctypes.byref(dev_interface_data)
+            index, ctypes.byref(dev_interface_data)
         ):
             if ctypes.GetLastError() != ERROR_NO_MORE_ITEMS:
                 raise ConnectionError('SetupDiEnumDeviceInterfaces: %s' % ctypes.WinError())
-            return INVALID_HANDLE_VALUE
+            return None
 
         request_length = wintypes.DWORD(0)
         status = SetupDiGetDeviceInterfaceDetail(
@@ -176,8 +195,10 @@ class WindowsUsbTransport(MachineTransport):
         ):
             raise ConnectionError('SetupDiGetDeviceInterfaceDetail: %s' % ctypes.WinError())
 
-        device_path = dev_detail_data_ptr[0].DevicePath
+        return dev_detail_data_ptr[0].DevicePath
 
+    @staticmethod
+    def _open_device_path(device_path):
         handle = CreateFile(device_path,
                             GENERIC_READ | GENERIC_WRITE,
                             FILE_SHARE_READ | FILE_SHARE_WRITE,
@@ -189,20 +210,39 @@ class WindowsUsbTransport(MachineTransport):
             raise ConnectionError('CreateFile: %s' % ctypes.WinError())
         return handle
 
-    @staticmethod
-    def _open_device_by_class_interface_and_instance(class_guid):
+    def _claim_device_path(self, class_guid, index=0):
+        """Find the first writer from index on no other transport is using, and mark it as ours"""
         device_info = SetupDiGetClassDevs(ctypes.byref(class_guid), None, None,
                                           DIGCF_DEVICEINTERFACE | DIGCF_PRESENT)
         if device_info == INVALID_HANDLE_VALUE:
             raise ConnectionError('SetupDiGetClassDevs: %s' % ctypes.WinError())
-        usb_device = WindowsUsbTransport._open_device_instance(device_info, class_guid)
-        if not SetupDiDestroyDeviceInfoList(device_info):
-            raise ConnectionError('SetupDiDestroyDeviceInfoList: %s' % ctypes.WinError())
-        return usb_device
+        try:
+            with _claimed_devices_lock:
+                while True:
+                    device_path = self._device_instance_path(device_info, class_guid, index)
+                    if device_path is None:
+                        return None
+                    if device_path not in _claimed_devices:
+                        _claimed_devices.add(device_path)
+                        self._device_path = device_path
+                        return device_path
+                    index += 1
+        finally:
+            if not SetupDiDestroyDeviceInfoList(device_info):
+                raise ConnectionError('SetupDiDestroyDeviceInfoList: %s' % ctypes.WinError())
+
+    def _release_device(self):
+        if self._device_path is not None:
+            with _claimed_devices_lock:
+                _claimed_devices.discard(self._device_path)
+            self._device_path = None
 
     def _usb_write_packet(self, request):
         bytes_written = wintypes.DWORD(0)
         request_packet = request.pack()
+        if isinstance(request_packet, bytearray):
+            # ctypes only passes a bytearray through a typed view of it.
+            request_packet = (ctypes.c_char * len(request_packet)).from_buffer(request_packet)
         if not WriteFile(self._usb_device,
                          request_packet,
                          StenoPacket.HEADER_SIZE + request.data_length,
@@ -215,7 +255,7 @@ class WindowsUsbTransport(MachineTransport):
         bytes_read = wintypes.DWORD(0)
         if not ReadFile(self._usb_device,
                         self._read_buffer,
-                        MAX_READ + StenoPacket.HEADER_SIZE,
+                        ctypes.sizeof(self._read_buffer),
                         ctypes.byref(bytes_read),
                         None):
             raise ConnectionError('ReadFile: %s' % ctypes.WinError())
@@ -226,25 +266,34 @@ class WindowsUsbTransport(MachineTransport):
         return writer_packet
 
     def disconnect(self):
+        usb_device = self._usb_device
         self._usb_device = INVALID_HANDLE_VALUE
-        if not CloseHandle(self._usb_device):
+        self._release_device()
+        if usb_device != INVALID_HANDLE_VALUE and not CloseHandle(usb_device):
             raise ConnectionError('CloseHandle: %s' % ctypes.WinError())
 
     def connect(self):
         # If already connected, disconnect first.
         if self._usb_device != INVALID_HANDLE_VALUE:
             self.disconnect()
-        self._usb_device = self._open_device_by_class_interface_and_instance(USB_WRITER_GUID)
-        return self._usb_device != INVALID_HANDLE_VALUE
-
-    def send_receive(self, request):
+        device_path = self._claim_device_path(USB_WRITER_GUID, self.device_index)
+        if device_path is None:
+            raise ConnectionError("USB device not connected")
+        try:
+            self._usb_device = self._open_device_path(device_path)
+        except ConnectionError:
+            self._release_device()
+            raise
+        return True
+
+    def send(self, request):
         if self._usb_device == INVALID_HANDLE_VALUE:
             raise ConnectionError("USB device is not open")
         written = self._usb_write_packet(request)
         if written < StenoPacket.HEADER_SIZE:
             raise ConnectionError("Could not write to USB device")
-        writer_packet = self._usb_read_packet()
-        if (writer_packet.sequence_number == request.sequence_number and
-            writer_packet.packet_type == request.packet_type):
-            return self.handle_response(writer_packet)
-        raise ProtocolViolationException()
+
+    def receive(self):
+        if self._usb_device == INVALID_HANDLE_VALUE:
+            raise ConnectionError("USB device is not open")
+        return self._usb_read_packet()
@@ -0,0 +1,107 @@
+from stenograph.emulator import EmulatedTransport, EmulatedWriter
+from stenograph.reader import RealtimeReader
+from stenograph.stroke import STROKE_SIZE, Stroke
+
+
+def strokes_as_tuples(strokes):
+    return [(stroke.mask, stroke.timestamp) for stroke in strokes]
+
+
+def file_strokes(writer, count):
+    """The last count strokes in the writer's realtime file"""
+    data = bytes(writer.realtime_file)
+    return strokes_as_tuples(Stroke.unpack_many(data[len(data) - count * STROKE_SIZE:]))
+
+
+def poll(reader, transport, cycles=50):
+    """Run reader against transport like StenographMachine.run(), returning the strokes"""
+    strokes = []
+    for _ in range(cycles):
+        if reader.catching_up:
+            for response in transport.read_pipelined(reader.offset):
+                strokes.extend(reader.handle_response(response))
+        else:
+            strokes.extend(reader.handle_response(transport.send_receive(reader.next_request())))
+    return strokes_as_tuples(strokes)
+
+
+def reconnect(reader, transport):
+    reader.disconnected()
+    transport.disconnect()
+    transport.connect()
+
+
+def connected_reader(writer, **kwargs):
+    transport = EmulatedTransport(writer, pipeline_depth=4)
+    transport.connect()
+    reader = RealtimeReader(**kwargs)
+    return reader, transport
+
+
+def test_skips_strokes_written_before_connecting():
+    writer = EmulatedWriter(realtime_strokes=1000)
+    reader, transport = connected_reader(writer)
+    assert poll(reader, transport) == []
+    assert reader.realtime
+    writer.write_strokes(3)
+    assert poll(reader, transport) == file_strokes(writer, 3)
+
+
+def test_resumes_same_file():
+    writer = EmulatedWriter(realtime_strokes=100)
+    reader, transport = connected_reader(writer)
+    poll(reader, transport)
+    writer.write_strokes(5)
+    assert poll(reader, transport) == file_strokes(writer, 5)
+
+    reconnect(reader, transport)
+    writer.write_strokes(7)
+    # Strokes written while disconnected are delivered, and only once.
+    assert poll(reader, transport) == file_strokes(writer, 7)
+    writer.write_strokes(2)
+    assert poll(reader, transport) == file_strokes(writer, 2)
+
+
+def test_resumes_without_fast_forward():
+    writer = EmulatedWriter(realtime_strokes=100)
+    reader, transport = connected_reader(writer, fast_forward=False)
+    assert poll(reader, transport) == []
+    reconnect(reader, transport)
+    writer.write_strokes(4)
+    assert poll(reader, transport) == file_strokes(writer, 4)
+
+
+def test_resumes_repeatedly_before_realtime():
+    writer = EmulatedWriter(realtime_strokes=100)
+    reader, transport = connected_reader(writer)
+    poll(reader, transport)
+    writer.write_strokes(5)
+    # Dropped again before reading anything: still resumes from where it was.
+    reconnect(reader, transport)
+    poll(reader, transport, cycles=1)
+    reconnect(reader, transport)
+    assert poll(reader, transport) == file_strokes(writer, 5)
+
+
+def test_starts_over_on_new_file():
+    writer = EmulatedWriter(realtime_strokes=100)
+    reader, transport = connected_reader(writer)
+    poll(reader, transport)
+
+    reconnect(reader, transport)
+    # A new job: different strokes, even the first one.
+    writer.realtime_file[:] = b''.join(writer.make_stroke(1) for _ in range(150))
+    assert poll(reader, transport) == []
+    writer.write_strokes(3)
+    assert poll(reader, transport) == file_strokes(writer, 3)
+
+
+def test_starts_over_on_new_file_with_same_first_stroke():
+    writer = EmulatedWriter(realtime_strokes=100)
+    reader, transport = connected_reader(writer)
+    poll(reader, transport)
+
+    reconnect(reader, transport)
+    first = bytes(writer.realtime_file[:STROKE_SIZE])
+    writer.realtime_file[:] = first + b''.join(writer.make_stroke(1) for _ in range(149))
+    assert poll(reader, transport) == []
@@ -0,0 +1,56 @@
+from math import log2
+
+import pytest
+
+from stenograph.packet import PacketType, StenoPacket
+from stenograph.seek import EndOfFileSeeker
+from stenograph.stroke import STROKE_SIZE
+
+
+PROBE_SIZE = 0x200
+
+
+def read_response(request, file_size):
+    data_length = max(0, min(request.p2, file_size - request.p1))
+    return StenoPacket(sequence_number=0, packet_type=PacketType.READ_FILE,
+                       data=bytes(data_length))
+
+
+def seek(file_size, grow_by=0, probe_size=PROBE_SIZE):
+    seeker = EndOfFileSeeker(probe_size=probe_size)
+    end = None
+    while end is None:
+        assert seeker.probes < 100, 'seeker does not converge'
+        end = seeker.handle_response(read_response(seeker.next_request(), file_size))
+        file_size += grow_by
+    return seeker, end
+
+
+@pytest.mark.parametrize('strokes', [0, 1, 63, 64, 65, 128, 1000, 12345, 100000])
+def test_finds_end(strokes):
+    file_size = strokes * STROKE_SIZE
+    seeker, end = seek(file_size)
+    assert end == file_size
+
+
+@pytest.mark.parametrize('strokes', [1000, 12345, 100000])
+def test_logarithmic_probes(strokes):
+    file_size = strokes * STROKE_SIZE
+    seeker, _end = seek(file_size)
+    # Doubling up past the end, then halving back down to one probe.
+    assert seeker.probes <= 2 * log2(file_size / PROBE_SIZE) + 3
+
+
+def test_file_growing_while_seeking():
+    file_size = 5000 * STROKE_SIZE
+    grow_by = 10 * STROKE_SIZE
+    seeker, end = seek(file_size, grow_by=grow_by)
+    # The end of the file as of the last probe, which read it short.
+    assert end == file_size + (seeker.probes - 1) * grow_by
+
+
+def test_reuses_request():
+    seeker = EndOfFileSeeker()
+    first = seeker.next_request()
+    seeker.handle_response(read_response(first, 10 * PROBE_SIZE))
+    assert seeker.next_request() is first
@@ -0,0 +1,58 @@
+from threading import Thread
+
+from stenograph.stroke_queue import StrokeQueue
+
+
+def test_fifo():
+    queue = StrokeQueue(4)
+    for item in range(3):
+        assert queue.put(item)
+    assert [queue.get() for _ in range(3)] == [0, 1, 2]
+    assert len(queue) == 0
+
+
+def test_drops_oldest_when_full():
+    queue = StrokeQueue(4)
+    results = [queue.put(item) for item in range(6)]
+    assert results == [True, True, True, True, False, False]
+    assert queue.dropped == 2
+    assert queue.max_depth == 4
+    assert [queue.get() for _ in range(4)] == [2, 3, 4, 5]
+    assert queue.summary() == {'depth': 0, 'max_depth': 4, 'dropped': 2, 'size': 4}
+
+
+def test_close_lets_get_drain_then_return_none():
+    queue = StrokeQueue(4)
+    queue.put('a')
+    queue.close()
+    assert queue.get() == 'a'
+    assert queue.get() is None
+    queue.open()
+    queue.put('b')
+    assert queue.get() == 'b'
+
+
+def test_close_wakes_waiting_get():
+    queue = StrokeQueue(4)
+    results = []
+    consumer = Thread(target=lambda: results.append(queue.get()))
+    consumer.start()
+    queue.close()
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert results == [None]
+
+
+def test_put_wakes_waiting_get():
+    queue = StrokeQueue(4)
+    results = []
+    consumer = Thread(target=lambda: results.extend(iter(queue.get, None)))
+    consumer.start()
+    for item in range(100):
+        queue.put(item)
+    queue.close()
+    consumer.join(5)
+    assert not consumer.is_alive()
+    # Whatever was dropped, what arrives is in order and ends with the last stroke.
+    assert results == sorted(results) and results[-1] == 99
+    assert len(results) + queue.dropped == 100
@@ -0,0 +1,96 @@
+import pytest
+
+from stenograph.emulator import EmulatedTransport, EmulatedWriter
+from stenograph.exception import FileNotAvailableException
+from stenograph.packet import MAX_READ, StenoPacket
+from stenograph.stroke import STROKE_SIZE
+
+
+class ReorderingTransport(EmulatedTransport):
+    """Answers the requests in flight newest first"""
+
+    def receive(self):
+        assert self.connected, 'cannot read from machine if not connected'
+        self.received_out_of_order += len(self._pending) > 1
+        return StenoPacket.unpack(self._pending.pop())
+
+
+def open_transport(writer, depth=4, max_read=None, transport_class=ReorderingTransport):
+    transport = transport_class(writer, pipeline_depth=depth, max_read=max_read)
+    transport.received_out_of_order = 0
+    transport.connect()
+    transport.send_receive(StenoPacket.make_open_request())
+    return transport
+
+
+def read_all(transport, offset=0, byte_count=MAX_READ):
+    return b''.join(bytes(response.data[:response.data_length])
+                    for response in transport.read_pipelined(offset, byte_count))
+
+
+@pytest.mark.parametrize('strokes', [0, 1, 64, 65, 1000, 5000])
+def test_delivers_in_offset_order(strokes):
+    writer = EmulatedWriter(realtime_strokes=strokes)
+    transport = open_transport(writer)
+    assert read_all(transport) == bytes(writer.realtime_file)
+    if strokes > 64:
+        assert transport.received_out_of_order
+
+
+def test_from_offset():
+    writer = EmulatedWriter(realtime_strokes=1000)
+    transport = open_transport(writer)
+    offset = 123 * STROKE_SIZE
+    assert read_all(transport, offset) == bytes(writer.realtime_file[offset:])
+
+
+def test_leaves_nothing_in_flight():
+    writer = EmulatedWriter(realtime_strokes=1000)
+    transport = open_transport(writer)
+    read_all(transport)
+    # The next exchange gets its own response, not a leftover read.
+    transport.send_receive(StenoPacket.make_open_request())
+
+
+def test_drains_when_abandoned():
+    writer = EmulatedWriter(realtime_strokes=5000)
+    transport = open_transport(writer)
+    responses = transport.read_pipelined(0)
+    next(responses)
+    responses.close()
+    transport.send_receive(StenoPacket.make_open_request())
+
+
+def test_shrinks_refused_reads():
+    writer = EmulatedWriter(realtime_strokes=5000, max_read=0x400)
+    transport = open_transport(writer, max_read=0x2000)
+    assert read_all(transport) == bytes(writer.realtime_file)
+    assert transport.max_read == 0x400
+
+
+def test_raises_error_when_due():
+    writer = EmulatedWriter(realtime_strokes=1000)
+    transport = open_transport(writer)
+    # Reading needs an open file.
+    writer.disconnected()
+    with pytest.raises(FileNotAvailableException):
+        read_all(transport)
+    transport.send_receive(StenoPacket.make_open_request())
+
+
+def test_in_order_transport():
+    writer = EmulatedWriter(realtime_strokes=1000)
+    transport = open_transport(writer, transport_class=EmulatedTransport)
+    assert read_all(transport) == bytes(writer.realtime_file)
+
+
+@pytest.mark.parametrize('max_read, expected', [
+    (0x100, MAX_READ), (1001, 1000), (0x2000, 0x2000),
+])
+def test_max_read_fits_requests(max_read, expected):
+    writer = EmulatedWriter(realtime_strokes=1000)
+    transport = open_transport(writer, max_read=max_read)
+    assert transport.max_read == expected
+    transport.set_max_read(max_read)
+    assert transport.max_read == expected
+    assert read_all(transport) == bytes(writer.realtime_file)
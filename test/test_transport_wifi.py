@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+from threading import Thread
+import socket
+
+import pytest
+
+from stenograph.emulator import EmulatedWriter, WiFiEmulator
+from stenograph.exception import ConnectionError
+from stenograph.packet import StenoPacket
+from stenograph.transport_wifi import (
+    KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, WiFiTransport, configure_socket,
+)
+
+
+@contextmanager
+def connected(emulator, **kwargs):
+    kwargs.setdefault('address', '127.0.0.1')
+    transport = WiFiTransport(port=emulator.port, **kwargs)
+    transport.connect()
+    try:
+        yield transport
+    finally:
+        transport.disconnect()
+
+
+@contextmanager
+def raw_server(reply):
+    """Accept one connection, and answer its first request with reply"""
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        client, _address = server.accept()
+        with client:
+            client.recv(1024)
+            client.sendall(reply)
+            client.recv(1024)
+
+    thread = Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        yield server.getsockname()[1]
+    finally:
+        server.close()
+        thread.join(5)
+
+
+class RefusingSocket:
+    """Records the options set, refusing the ones in refused"""
+
+    def __init__(self, refused):
+        self.refused = refused
+        self.options = {}
+        self.ioctls = []
+
+    def setsockopt(self, level, option, value):
+        if option in self.refused:
+            raise OSError(22, 'Invalid argument')
+        self.options[option] = value
+
+    def ioctl(self, control, value):
+        self.ioctls.append((control, value))
+
+
+def read_all(transport):
+    transport.send_receive(StenoPacket.make_open_request())
+    return b''.join(bytes(response.data[:response.data_length])
+                    for response in transport.read_pipelined(0))
+
+
+def test_reassembles_split_packets():
+    writer = EmulatedWriter(realtime_strokes=60)
+    with WiFiEmulator(writer, split_size=7) as emulator, connected(emulator) as transport:
+        assert read_all(transport) == bytes(writer.realtime_file)
+
+
+def test_pipelined_reads():
+    writer = EmulatedWriter(realtime_strokes=5000)
+    with WiFiEmulator(writer) as emulator, connected(emulator) as transport:
+        assert read_all(transport) == bytes(writer.realtime_file)
+        # Nothing left over from the reads ahead to answer the next request.
+        transport.send_receive(StenoPacket.make_open_request())
+
+
+def test_lost_framing():
+    with raw_server(b'HTTP/1.1 200 OK\r\n\r\n' + b'x' * 40) as port:
+        transport = WiFiTransport(address='127.0.0.1', port=port)
+        transport.connect()
+        try:
+            with pytest.raises(ConnectionError, match='framing'):
+                transport.send_receive(StenoPacket.make_open_request())
+            # The junk is gone rather than parsed again.
+            assert transport.connection.next_packet() is None
+        finally:
+            transport.disconnect()
+
+
+def test_one_transport_per_writer():
+    with WiFiEmulator(EmulatedWriter()) as emulator:
+        with connected(emulator) as transport:
+            with pytest.raises(ConnectionError, match='already in use'):
+                with connected(emulator):
+                    pass
+            assert transport.connection.claimed == ('127.0.0.1', emulator.port)
+        with connected(emulator) as transport:
+            transport.send_receive(StenoPacket.make_open_request())
+
+
+def test_remembers_discovered_writer(tmp_path):
+    address_cache = tmp_path / 'address'
+    with WiFiEmulator(EmulatedWriter()) as emulator:
+        with connected(emulator, address=None, address_cache=str(address_cache),
+                       discovery_address='127.0.0.1',
+                       discovery_port=emulator.discovery_port) as transport:
+            transport.send_receive(StenoPacket.make_open_request())
+    assert address_cache.read_text() == '127.0.0.1'
+
+
+def test_forgets_remembered_writer_that_never_answers(tmp_path):
+    address_cache = tmp_path / 'address'
+    address_cache.write_text('127.0.0.1')
+    with raw_server(b'x' * 40) as port:
+        transport = WiFiTransport(address_cache=str(address_cache), port=port)
+        transport.connect()
+        try:
+            with pytest.raises(ConnectionError):
+                transport.send_receive(StenoPacket.make_open_request())
+        finally:
+            transport.disconnect()
+    assert transport.connection.last_host is None
+    assert address_cache.read_text() == ''
+
+
+def test_socket_options_are_best_effort():
+    refused = {getattr(socket, name) for name in ('TCP_KEEPIDLE', 'TCP_KEEPALIVE', 'TCP_NODELAY')
+               if hasattr(socket, name)}
+    sock = RefusingSocket(refused)
+    configure_socket(sock, 5)
+    assert sock.options[socket.SO_KEEPALIVE] == 1
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        assert sock.options[socket.TCP_USER_TIMEOUT] == 5000
+    if hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        assert sock.ioctls == [(socket.SIO_KEEPALIVE_VALS, (1, KEEPALIVE_IDLE * 1000, KEEPALIVE_INTERVAL * 1000))]